@@ -3,16 +3,20 @@ from datetime import datetime
 from binance_trade_bot import backtest
 
 if __name__ == "__main__":
-    history = []
-    for manager in backtest(datetime(2021, 1, 1), datetime.now()):
-        btc_value = manager.collate_coins("BTC")
-        bridge_value = manager.collate_coins(manager.config.BRIDGE.symbol)
-        history.append((btc_value, bridge_value))
-        btc_diff = round((btc_value - history[0][0]) / history[0][0] * 100, 3)
-        bridge_diff = round((bridge_value - history[0][1]) / history[0][1] * 100, 3)
+    manager = None
+    for manager in backtest(datetime(2021, 1, 1), datetime.now(), fast=True):
+        equity = manager.equity
+        last = equity.size - 1
+        btc_diff = round((equity.btc_values[last] - equity.btc_values[0]) / equity.btc_values[0] * 100, 3)
+        bridge_diff = round((equity.bridge_values[last] - equity.bridge_values[0]) / equity.bridge_values[0] * 100, 3)
         print("------")
         print("TIME:", manager.datetime)
         print("BALANCES:", manager.balances)
-        print("BTC VALUE:", btc_value, f"({btc_diff}%)")
-        print(f"{manager.config.BRIDGE.symbol} VALUE:", bridge_value, f"({bridge_diff}%)")
+        print("BTC VALUE:", equity.btc_values[last], f"({btc_diff}%)")
+        print(f"{manager.config.BRIDGE.symbol} VALUE:", equity.bridge_values[last], f"({bridge_diff}%)")
         print("------")
+
+    if manager is not None and manager.equity.size:
+        print("RESULT:")
+        for name, value in manager.result().info().items():
+            print(f"    {name}: {value}")
@@ -0,0 +1,106 @@
+"""
+Latency of independent REST reads, sent one after the other through binance.client.Client and fanned out
+through AsyncBinanceClient, against a local stand-in of the Binance REST API that answers every request
+after LATENCY seconds.
+
+    python -m benchmarks.async_client
+"""
+import asyncio
+import statistics
+import threading
+import time
+
+from aiohttp import web
+from binance.client import Client
+
+from binance_trade_bot.async_client import AsyncBinanceClient
+
+LATENCY = 0.05
+REPEAT = 10
+SYMBOLS = ["BTCUSDT", "ETHUSDT", "ADAUSDT"]
+
+RESPONSES = {
+    "/api/v3/ping": {},
+    "/api/v3/account": {"balances": [{"asset": "USDT", "free": "100.0", "locked": "0.0"}]},
+    "/api/v3/ticker/price": [{"symbol": symbol, "price": "1.0"} for symbol in SYMBOLS],
+    "/api/v3/exchangeInfo": {"symbols": [], "rateLimits": []},
+    "/sapi/v1/bnbBurn": {"spotBNBBurn": False},
+}
+
+
+class StandInServer:
+    """
+    Local HTTP server answering the few REST endpoints used here, and counting the connections it accepted
+    """
+
+    def __init__(self):
+        self.connections = set()
+        self.port = None
+        self._loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stand-in-server", daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    async def _handle(self, request: web.Request):
+        self.connections.add(request.transport.get_extra_info("peername"))
+        await asyncio.sleep(LATENCY)
+        return web.json_response(RESPONSES[request.path])
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        for path in RESPONSES:
+            app.router.add_get(path, self._handle)
+        runner = web.AppRunner(app)
+        self._loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]  # pylint: disable=protected-access
+        self._started.set()
+        self._loop.run_forever()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+
+def measure(name: str, server: StandInServer, read):
+    server.connections.clear()
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        read()
+        timings.append(time.perf_counter() - start)
+    print(
+        f"{name:>36}: median {statistics.median(timings) * 1000:7.1f} ms, "
+        f"{len(server.connections)} connections for {REPEAT} rounds"
+    )
+
+
+def main():
+    server = StandInServer()
+
+    sync_client = Client("key", "secret", ping=False)
+    sync_client.API_URL = server.url + "/api"
+    sync_client.MARGIN_API_URL = server.url + "/sapi"
+    async_client = AsyncBinanceClient("key", "secret", api_url=server.url)
+
+    print(f"3 independent reads, {LATENCY * 1000:.0f} ms per request")
+    for name, client in (("Client", sync_client), ("AsyncBinanceClient, synchronous", async_client)):
+        measure(
+            name,
+            server,
+            lambda client=client: (client.get_account(), client.get_symbol_ticker(), client.get_exchange_info()),
+        )
+    inner = async_client.client
+    measure(
+        "AsyncBinanceClient, gathered",
+        server,
+        lambda: async_client.gather(inner.get_account(), inner.get_symbol_ticker(), inner.get_exchange_info()),
+    )
+    async_client.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Query times of the history tables before and after the schema migrations, on a database holding a year of
+history that was never pruned.
+
+    python -m benchmarks.history_queries [path]
+"""
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from binance_trade_bot import migrations
+from binance_trade_bot.config import Config
+from binance_trade_bot.database import Database
+from binance_trade_bot.logger import Logger
+from binance_trade_bot.models import Base, CoinValue, CurrentCoin, Interval, Pair, ScoutHistory, Trade, TradeState
+
+COINS = ["ADA", "ATOM", "BAT", "DOGE", "EOS", "ICX", "IOTA", "NEO", "ONT", "XLM"]
+DAYS = 365
+VALUE_MINUTES = 1  # one value per minute for the coin held at the time
+SCOUT_MINUTES = 5  # the pairs of the current coin are scouted every 5 minutes
+JUMPS = 2000
+REPEAT = 5
+
+
+def populate(db: Database):
+    db.set_coins(COINS)
+    pair_ids = {(pair.from_coin_id, pair.to_coin_id): pair.id for pair in db.get_pairs()}
+    start = datetime.now() - timedelta(days=DAYS)
+    minutes = DAYS * 24 * 60
+    jump_minutes = sorted(random.sample(range(minutes), JUMPS))
+    held = [random.choice(COINS)]
+    for _ in jump_minutes:
+        held.append(random.choice([coin for coin in COINS if coin != held[-1]]))
+
+    values = []
+    scouts = []
+    last = None
+    jumps = 0
+    for minute in range(0, minutes, VALUE_MINUTES):
+        date = start + timedelta(minutes=minute)
+        while jumps < JUMPS and jump_minutes[jumps] <= minute:
+            jumps += 1
+        coin = held[jumps]
+        if last is None or date.strftime("%Y-%W") != last.strftime("%Y-%W"):
+            interval = Interval.WEEKLY
+        elif date.date() != last.date():
+            interval = Interval.DAILY
+        elif date.hour != last.hour:
+            interval = Interval.HOURLY
+        else:
+            interval = Interval.MINUTELY
+        last = date
+        values.append(
+            {
+                "coin_id": coin,
+                "balance": 1.0,
+                "usd_price": 1.0,
+                "btc_price": 1.0,
+                "interval": interval,
+                "datetime": date,
+            }
+        )
+        if minute % SCOUT_MINUTES == 0:
+            for to_coin in COINS:
+                if to_coin != coin:
+                    scouts.append(
+                        {
+                            "pair_id": pair_ids[(coin, to_coin)],
+                            "target_ratio": 1.0,
+                            "current_coin_price": 1.0,
+                            "other_coin_price": 1.0,
+                            "datetime": date,
+                        }
+                    )
+
+    trades = []
+    current_coins = []
+    for i, minute in enumerate(jump_minutes):
+        date = start + timedelta(minutes=minute)
+        current_coins.append({"coin_id": held[i + 1], "datetime": date})
+        for alt_coin, selling in ((held[i], True), (held[i + 1], False)):
+            trades.append(
+                {
+                    "alt_coin_id": alt_coin,
+                    "crypto_coin_id": "USDT",
+                    "selling": selling,
+                    "state": TradeState.COMPLETE,
+                    "datetime": date,
+                }
+            )
+
+    tables = ((CoinValue, values), (ScoutHistory, scouts), (Trade, trades), (CurrentCoin, current_coins))
+    with db.db_session() as session:
+        for model, rows in tables:
+            session.execute(model.__table__.insert(), rows)
+    print(f"{len(values)} values, {len(scouts)} scouts, {len(trades)} trades")
+    return held[-1]
+
+
+def queries(current_coin: str):
+    now = datetime.now()
+    return {
+        "value history of a coin, 1 day": lambda s: s.query(CoinValue)
+        .filter(CoinValue.coin_id == current_coin, CoinValue.datetime >= now - timedelta(days=1))
+        .order_by(CoinValue.datetime.asc())
+        .all(),
+        "total value history, 1 week": lambda s: s.query(
+            CoinValue.datetime, func.sum(CoinValue.btc_value), func.sum(CoinValue.usd_value)
+        )
+        .filter(CoinValue.datetime >= now - timedelta(weeks=1))
+        .group_by(CoinValue.datetime)
+        .all(),
+        "scouting history, 1 hour": lambda s: s.query(ScoutHistory)
+        .join(ScoutHistory.pair)
+        .filter(Pair.from_coin_id == current_coin, ScoutHistory.datetime >= now - timedelta(hours=1))
+        .order_by(ScoutHistory.datetime.asc())
+        .all(),
+        "trade history, 4 weeks": lambda s: s.query(Trade)
+        .filter(Trade.datetime >= now - timedelta(days=28))
+        .order_by(Trade.datetime.asc())
+        .all(),
+        "current coin history, 1 week": lambda s: s.query(CurrentCoin)
+        .filter(CurrentCoin.datetime >= now - timedelta(weeks=1))
+        .all(),
+        "last value of a coin": lambda s: s.query(func.max(CoinValue.datetime))
+        .filter(CoinValue.coin_id == current_coin)
+        .scalar(),
+        "prune batch of minutely values": lambda s: s.query(CoinValue.id)
+        .filter(CoinValue.interval == Interval.MINUTELY, CoinValue.datetime < now - timedelta(hours=24))
+        .order_by(CoinValue.datetime.asc())
+        .limit(5000)
+        .all(),
+        "prune scout history count": lambda s: s.query(func.count(ScoutHistory.id))
+        .filter(ScoutHistory.datetime < now - timedelta(hours=1))
+        .scalar(),
+    }
+
+
+def measure(db: Database, current_coin: str):
+    results = {}
+    for name, query in queries(current_coin).items():
+        timings = []
+        for _ in range(REPEAT):
+            with db.db_session() as session:
+                start = time.perf_counter()
+                query(session)
+                timings.append(time.perf_counter() - start)
+        results[name] = statistics.median(timings) * 1000
+    return results
+
+
+def main(path="data/benchmark_history.db"):
+    random.seed(0)
+    logger = Logger("benchmark", enable_notifications=False)
+    config = Config()
+    if os.path.exists(path):
+        os.remove(path)
+    db = Database(logger, config, f"sqlite:///{path}")
+
+    # A database created before the migrations existed: no secondary indexes and schema version 0
+    Base.metadata.create_all(db.engine)
+    with db.engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+    current_coin = populate(db)
+    before = measure(db, current_coin)
+
+    start = time.perf_counter()
+    db.create_database()
+    migration_time = time.perf_counter() - start
+    with db.engine.connect() as connection:
+        print(f"Migrated to schema version {migrations.get_schema_version(connection)} in {migration_time:.2f}s")
+    after = measure(db, current_coin)
+
+    print(f"{'query':>32} {'before (ms)':>12} {'after (ms)':>12}")
+    for name in before:
+        print(f"{name:>32} {before[name]:12.2f} {after[name]:12.2f}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
@@ -0,0 +1,414 @@
+"""
+Benchmark suite of the hot paths of the bot: scouting (AutoTrader._get_ratios), persistence (Database.log_scout,
+prune_value_history, set_coins) and the api server endpoints.
+
+Every benchmark runs on synthetic data, once per coin count and/or history size it depends on, and reports
+its throughput and latency percentiles. The median latency of every case is compared with the stored
+baselines, and the run fails when one got more than `--tolerance` slower.
+
+    python -m benchmarks.hot_paths [--coins 10,100,500] [--days 1,30,365] [--only api]
+    python -m benchmarks.hot_paths --update-baselines
+
+The whole grid takes several minutes, --coins, --days and --only pick a part of it. Baselines depend on the
+machine: update them on the machine the suite is compared on.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from binance_trade_bot.auto_trader import AutoTrader
+from binance_trade_bot.config import Config
+from binance_trade_bot.database import Database
+from binance_trade_bot.logger import Logger
+from binance_trade_bot.models import Coin, CoinValue, CurrentCoin, Interval, ScoutHistory, Trade, TradeState
+
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines.json")
+COIN_COUNTS = [10, 100, 500]
+HISTORY_DAYS = [1, 30, 365]
+
+# A case is only a regression when it got slower by more than the tolerance and by more than this, so that
+# the noise of sub-millisecond cases doesn't fail the run
+MIN_REGRESSION_MS = 0.05
+
+# Shape of the synthetic history: the held coin's value every minute, a few jumps a day, and the scouts of
+# the last hour every 5 minutes, the older ones having been pruned
+JUMPS_PER_DAY = 4
+SCOUT_HISTORY_HOURS = 1
+SCOUT_MINUTES = 5
+
+# A case stops repeating once it ran for this many seconds
+CASE_BUDGET = 10
+
+SCOUT_REPEAT = 200
+LOG_SCOUT_RECORDS = 20000
+SET_COINS_REPEAT = 3
+PRUNE_REPEAT = 3
+API_REPEAT = 10
+API_ENDPOINTS = [
+    "/api/value_history/{coin}?period=1d",
+    "/api/value_history?period=1w&points=500",
+    "/api/total_value_history?period=1w",
+    "/api/trade_history",
+    "/api/scouting_history",
+    "/api/current_coin_history",
+    "/api/coins",
+    "/api/pairs",
+]
+
+config = Config()
+
+Case = Tuple[str, List[float], int]
+
+
+def coin_symbols(count: int) -> List[str]:
+    return [f"C{i:03d}" for i in range(count)]
+
+
+def create_database(logger: Logger, path: str, coins: List[str]) -> Database:
+    db = Database(logger, config, f"sqlite:///{path}")
+    db.create_database()
+    db.set_coins(coins)
+    return db
+
+
+def populate_history(db: Database, coins: List[str], days: int):  # pylint: disable=too-many-locals,too-many-branches
+    """
+    Fill a database with `days` of history that was never pruned, ending now
+    """
+    start = datetime.now() - timedelta(days=days)
+    minutes = days * 24 * 60
+    jump_minutes = sorted(random.sample(range(minutes), min(minutes, days * JUMPS_PER_DAY)))
+    held = [random.choice(coins)]
+    for _ in jump_minutes:
+        held.append(random.choice([coin for coin in coins if coin != held[-1]]))
+    pair_ids = {(pair.from_coin_id, pair.to_coin_id): pair.id for pair in db.get_pairs()}
+
+    with db.db_session() as session:
+        # The bridge gets a row once it was held, the trades refer to it
+        session.merge(Coin(config.BRIDGE.symbol, False))
+        jumps = 0
+        last = None
+        # A day at a time, to keep the rows in memory bounded
+        for day_start in range(0, minutes, 24 * 60):
+            values = []
+            for minute in range(day_start, min(minutes, day_start + 24 * 60)):
+                date = start + timedelta(minutes=minute)
+                while jumps < len(jump_minutes) and jump_minutes[jumps] <= minute:
+                    jumps += 1
+                if last is None or date.strftime("%Y-%W") != last.strftime("%Y-%W"):
+                    interval = Interval.WEEKLY
+                elif date.date() != last.date():
+                    interval = Interval.DAILY
+                elif date.hour != last.hour:
+                    interval = Interval.HOURLY
+                else:
+                    interval = Interval.MINUTELY
+                last = date
+                values.append(
+                    {
+                        "coin_id": held[jumps],
+                        "balance": 1.0,
+                        "usd_price": random.uniform(1, 2),
+                        "btc_price": random.uniform(1, 2) / 50000,
+                        "interval": interval,
+                        "datetime": date,
+                    }
+                )
+            session.execute(CoinValue.__table__.insert(), values)
+
+        trades = []
+        current_coins = []
+        for i, minute in enumerate(jump_minutes):
+            date = start + timedelta(minutes=minute)
+            current_coins.append({"coin_id": held[i + 1], "datetime": date})
+            for alt_coin, selling in ((held[i], True), (held[i + 1], False)):
+                trades.append(
+                    {
+                        "alt_coin_id": alt_coin,
+                        "crypto_coin_id": config.BRIDGE.symbol,
+                        "selling": selling,
+                        "state": TradeState.COMPLETE,
+                        "alt_trade_amount": 1.0,
+                        "crypto_trade_amount": 1.0,
+                        "datetime": date,
+                    }
+                )
+        current_coins.append({"coin_id": held[-1], "datetime": datetime.now()})
+
+        scouts = []
+        for minute in range(0, SCOUT_HISTORY_HOURS * 60, SCOUT_MINUTES):
+            date = datetime.now() - timedelta(minutes=minute)
+            for to_coin in coins:
+                if to_coin != held[-1]:
+                    scouts.append(
+                        {
+                            "pair_id": pair_ids[(held[-1], to_coin)],
+                            "target_ratio": 1.0,
+                            "current_coin_price": 1.0,
+                            "other_coin_price": 1.0,
+                            "datetime": date,
+                        }
+                    )
+
+        for model, rows in ((Trade, trades), (CurrentCoin, current_coins), (ScoutHistory, scouts)):
+            if rows:
+                session.execute(model.__table__.insert(), rows)
+
+
+def copy_database(source: str, destination: str):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(source + suffix):
+            shutil.copyfile(source + suffix, destination + suffix)
+
+
+class SyntheticManager:
+    """
+    Prices and fees of the synthetic coins, in place of BinanceAPIManager
+    """
+
+    def __init__(self, coins: List[str]):
+        self.prices = {coin + config.BRIDGE.symbol: random.uniform(0.1, 100) for coin in coins}
+
+    def move_prices(self):
+        for symbol, price in self.prices.items():
+            self.prices[symbol] = price * math.exp(random.gauss(0, 0.001))
+
+    def get_ticker_price(self, ticker_symbol: str):
+        return self.prices.get(ticker_symbol)
+
+    def get_fees_version(self):
+        return 0
+
+    def get_fee(self, origin_coin, target_coin, selling: bool):  # pylint: disable=unused-argument
+        return 0.001
+
+
+def timed(func: Callable[[], None]) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def sample(func: Callable[[], None], repeat: int) -> List[float]:
+    """
+    Latencies of up to `repeat` runs of `func`, fewer when they take longer than CASE_BUDGET
+    """
+    latencies = []
+    while len(latencies) < repeat and sum(latencies) < CASE_BUDGET:
+        latencies.append(timed(func))
+    return latencies
+
+
+def close_database(db: Database):
+    # Wait for everything to be written, so that the writer thread doesn't slow down the next cases
+    if db.scout_history_writer is not None:
+        db.scout_history_writer.stop(timeout=None)
+    db.close()
+    db.engine.dispose()
+
+
+def bench_scout(logger: Logger, directory: str, coin_count: int) -> Iterator[Case]:
+    coins = coin_symbols(coin_count)
+    db = create_database(logger, os.path.join(directory, f"scout-{coin_count}.db"), coins)
+    manager = SyntheticManager(coins)
+    db.update_pair_ratios(
+        {
+            pair: manager.prices[pair.from_coin_id + config.BRIDGE.symbol]
+            / manager.prices[pair.to_coin_id + config.BRIDGE.symbol]
+            for pair in db.get_pairs()
+        }
+    )
+    trader = AutoTrader(manager, db, logger, config)
+    trader.initialize_ratio_matrix()
+
+    coin = db.get_coin(coins[0])
+    latencies = []
+    for _ in range(SCOUT_REPEAT):
+        manager.move_prices()
+        price = manager.prices[coin + config.BRIDGE]
+        latencies.append(timed(lambda price=price: trader._get_ratios(coin, price)))  # pylint: disable=protected-access
+        if sum(latencies) > CASE_BUDGET:
+            break
+    close_database(db)
+    yield f"scout/get_ratios[coins={coin_count}]", latencies, len(latencies) * (coin_count - 1)
+
+
+def bench_log_scout(logger: Logger, directory: str, coin_count: int) -> Iterator[Case]:
+    coins = coin_symbols(coin_count)
+    db = create_database(logger, os.path.join(directory, f"log-scout-{coin_count}.db"), coins)
+    pairs = db.get_pairs_from(coins[0])
+
+    latencies = []
+    start = time.perf_counter()
+    for i in range(LOG_SCOUT_RECORDS):
+        pair = pairs[i % len(pairs)]
+        latencies.append(timed(lambda pair=pair: db.log_scout(pair, 1.0, 1.0, 1.0)))
+    # Until the writer thread stored them all
+    close_database(db)
+    total = time.perf_counter() - start
+    yield f"persistence/log_scout[coins={coin_count}]", latencies, LOG_SCOUT_RECORDS
+    yield f"persistence/log_scout_stored[coins={coin_count}]", [total], LOG_SCOUT_RECORDS
+
+
+def bench_set_coins(logger: Logger, directory: str, coin_count: int) -> Iterator[Case]:
+    coins = coin_symbols(coin_count)
+    created = []
+    existing = []
+    while len(created) < SET_COINS_REPEAT and sum(created) + sum(existing) < CASE_BUDGET:
+        path = os.path.join(directory, f"set-coins-{coin_count}-{len(created)}.db")
+        db = Database(logger, config, f"sqlite:///{path}")
+        db.create_database()
+        created.append(timed(lambda db=db: db.set_coins(coins)))
+        existing.append(timed(lambda db=db: db.set_coins(coins)))
+        close_database(db)
+    # Throughput in pairs per second
+    pairs = coin_count * (coin_count - 1)
+    yield f"persistence/set_coins_new[coins={coin_count}]", created, len(created) * pairs
+    yield f"persistence/set_coins_existing[coins={coin_count}]", existing, len(existing) * pairs
+
+
+def bench_prune_value_history(
+    logger: Logger, directory: str, template: str, coin_count: int, days: int
+) -> Iterator[Case]:
+    latencies = []
+    for i in range(PRUNE_REPEAT):
+        path = os.path.join(directory, f"prune-{i}.db")
+        copy_database(template, path)
+        db = Database(logger, config, f"sqlite:///{path}")
+        latencies.append(timed(db.prune_value_history))
+        close_database(db)
+    # Throughput in values of history pruned per second
+    yield f"persistence/prune_value_history[coins={coin_count},days={days}]", latencies, PRUNE_REPEAT * days * 1440
+
+
+def bench_api(logger: Logger, template: str, coin_count: int, days: int) -> Iterator[Case]:
+    from binance_trade_bot import api_server  # pylint: disable=import-outside-toplevel
+
+    api_server.db = Database(logger, config, f"sqlite:///{template}")
+    current_coin = api_server.db.get_current_coin().symbol
+    client = api_server.app.test_client()
+    for endpoint in API_ENDPOINTS:
+        url = endpoint.format(coin=current_coin)
+
+        def get(url=url):
+            # Measure the endpoint, not the response cache
+            api_server.cache.clear()
+            response = client.get(url)
+            response.get_data()
+            assert response.status_code == 200, f"{url}: {response.status_code}"
+
+        latencies = sample(get, API_REPEAT)
+        name = endpoint[len("/api/") :].replace("/{coin}", "")
+        yield f"api/{name}[coins={coin_count},days={days}]", latencies, len(latencies)
+    close_database(api_server.db)
+
+
+def wanted(group: str, only: str) -> bool:
+    """
+    Whether the cases of a group can match the name prefix given with --only
+    """
+    return group.startswith(only) or only.startswith(group)
+
+
+def run(logger: Logger, coin_counts: List[int], history_days: List[int], only: str) -> Iterator[Case]:
+    with tempfile.TemporaryDirectory() as directory:
+        for coin_count in coin_counts:
+            if wanted("scout", only):
+                yield from bench_scout(logger, directory, coin_count)
+            if wanted("persistence", only):
+                yield from bench_log_scout(logger, directory, coin_count)
+                yield from bench_set_coins(logger, directory, coin_count)
+
+        if not wanted("persistence", only) and not wanted("api", only):
+            return
+        for coin_count in coin_counts:
+            for days in history_days:
+                template = os.path.join(directory, f"history-{coin_count}-{days}.db")
+                db = create_database(logger, template, coin_symbols(coin_count))
+                populate_history(db, coin_symbols(coin_count), days)
+                close_database(db)
+                if wanted("persistence", only):
+                    yield from bench_prune_value_history(logger, directory, template, coin_count, days)
+                if wanted("api", only):
+                    yield from bench_api(logger, template, coin_count, days)
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(template + suffix):
+                        os.remove(template + suffix)
+
+
+def summarize(latencies: List[float], items: int) -> Dict[str, float]:
+    milliseconds = np.array(latencies) * 1000
+    return {
+        "samples": len(latencies),
+        "throughput": items / sum(latencies) if sum(latencies) else math.inf,
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p95_ms": float(np.percentile(milliseconds, 95)),
+        "p99_ms": float(np.percentile(milliseconds, 99)),
+        "max_ms": float(milliseconds.max()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--coins", default=",".join(map(str, COIN_COUNTS)), help="comma separated coin counts")
+    parser.add_argument("--days", default=",".join(map(str, HISTORY_DAYS)), help="comma separated history sizes")
+    parser.add_argument("--only", default="", help="only run the cases whose name starts with this")
+    parser.add_argument("--baselines", default=BASELINES)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="slowdown of the median that fails the run")
+    parser.add_argument("--update-baselines", action="store_true", help="store the results as the baselines")
+    args = parser.parse_args()
+
+    logger = Logger("benchmark", enable_notifications=False)
+    random.seed(0)
+    baselines: Dict[str, Dict[str, float]] = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines, encoding="utf-8") as f:
+            baselines = json.load(f)
+
+    results: Dict[str, Dict[str, float]] = {}
+    regressions = []
+    print(f"{'case':<72} {'per second':>12} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'baseline':>14}")
+    coin_counts = [int(count) for count in args.coins.split(",")]
+    history_days = [int(days) for days in args.days.split(",")]
+    for name, latencies, items in run(logger, coin_counts, history_days, args.only):
+        if not name.startswith(args.only):
+            continue
+        result = results[name] = summarize(latencies, items)
+        baseline = baselines.get(name, {}).get("p50_ms")
+        change = ""
+        if baseline is not None:
+            change = f"{(result['p50_ms'] / baseline - 1) * 100:+.0f}%" if baseline else ""
+            if result["p50_ms"] > baseline * (1 + args.tolerance) and result["p50_ms"] - baseline > MIN_REGRESSION_MS:
+                regressions.append(name)
+                change += " SLOWER"
+        print(
+            f"{name:<72} {result['throughput']:12.1f} {result['p50_ms']:10.3f} {result['p95_ms']:10.3f} "
+            f"{result['p99_ms']:10.3f} {change:>14}",
+            flush=True,
+        )
+
+    if args.update_baselines:
+        baselines.update(results)
+        with open(args.baselines, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(baselines.items())), f, indent=2)
+            f.write("\n")
+        print(f"Stored {len(results)} baselines in {args.baselines}")
+    elif regressions:
+        print(f"{len(regressions)} regressions over {args.tolerance:.0%} of the baseline median:")
+        for name in regressions:
+            print(f"  {name}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Soak and latency test of the live order path and stream processing, against a local MockExchange.
+
+The exchange ticks the prices of COINS every TICKER_INTERVAL seconds while a trader thread keeps buying and
+selling them through BinanceAPIManager, whose limit orders fill in FILL_PARTS executions FILL_LATENCY
+seconds apart. Reports the order round trips, the time from a ticker event leaving the exchange to its
+price being in the cache, and the depth of the stream event queue.
+
+    python -m benchmarks.mock_exchange_soak [seconds]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from binance_trade_bot.config import Config
+from binance_trade_bot.database import Database
+from binance_trade_bot.logger import Logger
+from binance_trade_bot.mock_exchange import MockExchange, MockExchangeAPIManager
+
+DURATION = 60
+COINS = [f"C{i:02d}" for i in range(50)]
+TICKER_INTERVAL = 0.005
+FILL_LATENCY = 0.02
+FILL_PARTS = 3
+
+
+def percentiles(name: str, values, unit="ms"):
+    values = np.array(values)
+    if not len(values):
+        print(f"{name:>24}: none")
+        return
+    print(
+        f"{name:>24}: {len(values)} samples, p50 {np.percentile(values, 50):8.2f} {unit}, "
+        f"p99 {np.percentile(values, 99):8.2f} {unit}, max {values.max():8.2f} {unit}"
+    )
+
+
+def trade(manager: MockExchangeAPIManager, coins, config: Config, deadline: float, round_trips):
+    i = 0
+    while time.monotonic() < deadline:
+        coin = coins[i % len(coins)]
+        i += 1
+        start = time.perf_counter()
+        if manager.buy_alt(coin, config.BRIDGE) is None or manager.sell_alt(coin, config.BRIDGE) is None:
+            print(f"Round trip of {coin} failed")
+            continue
+        round_trips.append((time.perf_counter() - start) * 1000)
+
+
+def main(duration: float):
+    config = Config()
+    logger = Logger("soak", enable_notifications=False)
+    # The trader thread needs the same database as the main thread, which an in-memory one isn't
+    directory = tempfile.TemporaryDirectory()
+    db = Database(logger, config, f"sqlite:///{os.path.join(directory.name, 'soak.db')}")
+    db.create_database()
+    db.set_coins(COINS)
+    coins = [db.get_coin(coin) for coin in COINS]
+
+    exchange = MockExchange(
+        {coin: 1 + i for i, coin in enumerate(COINS)},
+        {config.BRIDGE.symbol: 1000},
+        bridge=config.BRIDGE.symbol,
+        fill_latency=FILL_LATENCY,
+        fill_parts=FILL_PARTS,
+        ticker_interval=TICKER_INTERVAL,
+        seed=1,
+    ).start()
+    manager = MockExchangeAPIManager(config, db, logger, exchange)
+    stream_manager = manager.stream_manager
+
+    ticker_lags = []
+
+    def on_mini_ticker(stream_data):
+        stream_manager._on_mini_ticker(stream_data)  # pylint: disable=protected-access
+        ticker_lags.append(time.time() * 1000 - stream_data["data"][0]["event_time"])
+
+    stream_manager.register_handler("24hrMiniTicker", on_mini_ticker)
+
+    round_trips = []
+    deadline = time.monotonic() + duration
+    trader = threading.Thread(target=trade, args=(manager, coins, config, deadline, round_trips))
+    trader.start()
+    queue_depths = []
+    while trader.is_alive():
+        queue_depths.append(stream_manager.events.qsize())
+        time.sleep(0.01)
+
+    manager.close()
+    exchange.close()
+    db.close()
+    directory.cleanup()
+
+    print(f"{duration:.0f} s, {len(COINS)} symbols ticked every {TICKER_INTERVAL * 1000:.0f} ms")
+    percentiles("buy + sell round trip", round_trips)
+    percentiles("ticker event to cache", ticker_lags)
+    percentiles("stream queue depth", queue_depths, "events")
+    print(f"{'exchange':>24}: " + ", ".join(f"{count} {name}" for name, count in sorted(exchange.stats.items())))
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else DURATION)
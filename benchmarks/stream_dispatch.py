@@ -0,0 +1,109 @@
+"""
+Idle CPU use and event-to-cache latency of the stream processor.
+
+Feeds synthetic miniTicker events through the same callbacks the websocket threads use, and compares the
+blocking dispatcher of BinanceStreamManager with the old loop that polled the stream buffers every 10 ms.
+
+    python -m benchmarks.stream_dispatch
+"""
+import collections
+import threading
+import time
+
+import numpy as np
+
+from binance_trade_bot.binance_stream_manager import BinanceCache, BinanceStreamManager
+from binance_trade_bot.config import Config
+from binance_trade_bot.logger import Logger
+
+IDLE_SECONDS = 5
+EVENTS = 2000
+EVENT_SPACING = 0.002
+
+
+class OfflineWebsocketManager:
+    """
+    Stands in for the unicorn websocket manager, nothing is connected
+    """
+
+    def stop_manager_with_all_streams(self):
+        pass
+
+    def get_stream_info(self, stream_id):  # pylint: disable=unused-argument
+        return {"markets": []}
+
+
+class BlockingStreamManager(BinanceStreamManager):
+    def _create_websocket_manager(self):
+        return OfflineWebsocketManager()
+
+
+class PollingStreamManager(BlockingStreamManager):
+    """
+    The previous stream processor: pop from the stream buffers, sleep 10 ms when both are empty
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.buffer = collections.deque()
+        self.stopping = False
+        super().__init__(*args, **kwargs)
+
+    def _on_stream_data(self, stream_data, stream_buffer_name=False):
+        self.buffer.append(stream_data)
+
+    def _stream_processor(self):
+        while not self.stopping:
+            try:
+                stream_data = self.buffer.popleft()
+            except IndexError:
+                time.sleep(0.01)
+                continue
+            self._process_stream_data(stream_data)
+
+    def close(self):
+        self.stopping = True
+
+
+def measure(manager_class, logger: Logger):
+    cache = BinanceCache()
+    cache.ticker_values = {}
+    manager = manager_class(cache, Config(), None, logger)
+    latencies = []
+
+    def on_mini_ticker(stream_data):
+        manager._on_mini_ticker(stream_data)  # pylint: disable=protected-access
+        latencies.append(time.perf_counter() - stream_data["sent"])
+
+    manager.register_handler("24hrMiniTicker", on_mini_ticker)
+
+    cpu = time.process_time()
+    time.sleep(IDLE_SECONDS)
+    idle_cpu = (time.process_time() - cpu) / IDLE_SECONDS * 100
+
+    for i in range(EVENTS):
+        event = {"symbol": "BTCUSDT", "close_price": str(30000 + i)}
+        manager._on_stream_data(  # pylint: disable=protected-access
+            {"event_type": "24hrMiniTicker", "data": [event], "sent": time.perf_counter()}
+        )
+        time.sleep(EVENT_SPACING)
+    while len(latencies) < EVENTS:
+        time.sleep(0.1)
+    manager.close()
+
+    latencies = np.array(latencies) * 1000
+    print(
+        f"{manager_class.__name__:>24}: idle CPU {idle_cpu:5.2f}%, latency p50 {np.percentile(latencies, 50):.3f} ms, "
+        f"p99 {np.percentile(latencies, 99):.3f} ms, max {latencies.max():.3f} ms"
+    )
+
+
+def main():
+    logger = Logger("benchmark", enable_notifications=False)
+    for manager_class in (PollingStreamManager, BlockingStreamManager):
+        measure(manager_class, logger)
+    # Nothing else should be left running
+    assert threading.active_count() == 1, threading.enumerate()
+
+
+if __name__ == "__main__":
+    main()
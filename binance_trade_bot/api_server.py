@@ -1,18 +1,23 @@
+import base64
+import json
 import re
 from datetime import datetime, timedelta
-from itertools import groupby
-from typing import List, Tuple
+from itertools import chain, groupby
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-from flask import Flask, jsonify, request
+import numpy as np
+from flask import Flask, Response, abort, jsonify, request, stream_with_context
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit
-from sqlalchemy import func
-from sqlalchemy.orm import Session
+from sqlalchemy import DateTime, and_, func, or_
+from sqlalchemy.orm import Query, Session, contains_eager
 
 from .config import Config
 from .database import Database
+from .downsample import lttb
 from .logger import Logger
 from .models import Coin, CoinValue, CurrentCoin, Pair, ScoutHistory, Trade
+from .response_cache import ResponseCache
 
 app = Flask(__name__)
 cors = CORS(app, resources={r"/api/*": {"origins": "*"}})
@@ -24,45 +29,250 @@ logger = Logger("api_server")
 config = Config()
 db = Database(logger, config)
 
+# Responses are dropped when the bot sends an update of a table they read
+cache = ResponseCache()
 
-def filter_period(query, model):  # pylint: disable=inconsistent-return-statements
-    period = request.args.get("period", "all")
 
-    if period == "all":
-        return query
+# Most rows a paginated history request returns at once
+MAX_LIMIT = 10000
+
+# Rows fetched from the database cursor at a time while streaming a whole history
+STREAM_BATCH_SIZE = 1000
+
+# Most points a downsampled history can be asked for
+MAX_POINTS = 10000
+
+PERIOD_UNITS = {
+    "s": timedelta(seconds=1),
+    "h": timedelta(hours=1),
+    "d": timedelta(days=1),
+    "w": timedelta(weeks=1),
+    "m": timedelta(days=28),
+}
 
-    num = float(re.search(r"(\d*)[shdwm]", "1d").group(1))
 
-    if "s" in period:
-        return query.filter(model.datetime >= datetime.now() - timedelta(seconds=num))
-    if "h" in period:
-        return query.filter(model.datetime >= datetime.now() - timedelta(hours=num))
-    if "d" in period:
-        return query.filter(model.datetime >= datetime.now() - timedelta(days=num))
-    if "w" in period:
-        return query.filter(model.datetime >= datetime.now() - timedelta(weeks=num))
-    if "m" in period:
-        return query.filter(model.datetime >= datetime.now() - timedelta(days=28 * num))
+def _parse_datetime(name: str) -> Optional[datetime]:
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, f"Invalid {name} datetime: {value}")
+    return None
+
+
+def filter_period(query, model):
+    """
+    Keep the rows within the requested `period` (e.g. 1d, 12h, 2w) and `from`/`to` datetimes
+    """
+    period = request.args.get("period", "all")
+    if period != "all":
+        match = re.fullmatch(r"(\d*\.?\d*)([shdwm])", period)
+        if match is None:
+            abort(400, f"Invalid period: {period}")
+        num = float(match.group(1) or 1)
+        query = query.filter(model.datetime >= datetime.now() - num * PERIOD_UNITS[match.group(2)])
+
+    from_datetime = _parse_datetime("from")
+    if from_datetime is not None:
+        query = query.filter(model.datetime >= from_datetime)
+    to_datetime = _parse_datetime("to")
+    if to_datetime is not None:
+        query = query.filter(model.datetime < to_datetime)
+    return query
+
+
+def encode_cursor(values: List[Any]) -> str:
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, columns: List[Any]) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) != len(columns):
+            raise ValueError
+        return [
+            datetime.fromisoformat(value) if isinstance(column.type, DateTime) else value
+            for column, value in zip(columns, values)
+        ]
+    except ValueError:
+        abort(400, f"Invalid cursor: {cursor}")
+    return []
+
+
+def after_cursor(columns: List[Any], values: List[Any]):
+    """
+    Keyset condition selecting the rows that come after `values` in the order of `columns`
+    """
+    return or_(
+        *(and_(*(columns[j] == values[j] for j in range(i)), columns[i] > values[i]) for i in range(len(columns)))
+    )
+
+
+def history_response(
+    build_query: Callable[[Session], Any],
+    order_by: List[Any],
+    serialize: Callable[[Any], Any],
+    group_by: Callable[[Any], str] = None,
+):
+    """
+    Respond with the rows of a history query as a JSON list, or as a JSON object of lists by `group_by`.
+
+    With a `limit`, a page of at most `limit` rows following the `after` cursor is returned, and the cursor
+    of the next page is sent in the X-Next-Cursor header while there are more rows. Without a limit, the
+    whole history is streamed from the database cursor so that it never has to fit in memory.
+    """
+    limit = request.args.get("limit", type=int)
+    after = request.args.get("after")
+    if limit is not None and not 0 < limit <= MAX_LIMIT:
+        abort(400, f"limit must be between 1 and {MAX_LIMIT}")
+
+    def ordered_query(session: Session):
+        query = build_query(session).order_by(*order_by)
+        if after is not None:
+            query = query.filter(after_cursor(order_by, decode_cursor(after, order_by)))
+        return query
+
+    if limit is not None:
+        session: Session
+        with db.db_session() as session:
+            rows = ordered_query(session).limit(limit + 1).all()
+            page = rows[:limit]
+            if group_by is None:
+                response = jsonify([serialize(row) for row in page])
+            else:
+                response = jsonify(
+                    {key: [serialize(row) for row in group] for key, group in groupby(page, key=group_by)}
+                )
+            if len(rows) > limit:
+                response.headers["X-Next-Cursor"] = encode_cursor([getattr(page[-1], c.key) for c in order_by])
+            return response
+
+    def generate():
+        session: Session
+        with db.db_session() as session:
+            rows = ordered_query(session).yield_per(STREAM_BATCH_SIZE)
+            if group_by is None:
+                yield "["
+                for i, row in enumerate(rows):
+                    yield ("," if i else "") + json.dumps(serialize(row))
+                yield "]"
+                return
+
+            yield "{"
+            for i, (key, group) in enumerate(groupby(rows, key=group_by)):
+                yield ("," if i else "") + json.dumps(key) + ":["
+                for j, row in enumerate(group):
+                    yield ("," if j else "") + json.dumps(serialize(row))
+                yield "]"
+            yield "}"
+
+    # Run the generator up to its first chunk, so that invalid arguments still get a 400 response
+    stream = stream_with_context(generate())
+    first_chunk = next(stream)
+    return Response(chain([first_chunk], stream), mimetype="application/json")
+
+
+def _requested_points() -> Optional[int]:
+    points = request.args.get("points")
+    if points is None:
+        return None
+    if not points.isdigit() or not 3 <= int(points) <= MAX_POINTS:
+        abort(400, f"points must be between 3 and {MAX_POINTS}")
+    return int(points)
+
+
+def _unix_time(column):
+    """
+    SQL expression of a datetime column as seconds since the epoch, which is much cheaper to load into numpy
+    than datetime objects
+    """
+    return (func.julianday(column) - 2440587.5) * 86400.0
+
+
+def _datetime_of(unix_time: float) -> datetime:
+    # julianday() is precise to the millisecond
+    return datetime(1970, 1, 1) + timedelta(seconds=round(float(unix_time), 3))
+
+
+def _fetch_array(session: Session, query: Query, columns: int) -> np.ndarray:
+    """
+    Rows of a query selecting numeric columns only, as a float array
+
+    Reads the tuples straight from the DBAPI cursor: going through the result rows of SQLAlchemy costs several
+    times the query itself on histories of hundreds of thousands of rows.
+    """
+    result = session.connection().execute(query.statement)
+    try:
+        rows = result.cursor.fetchall()
+    finally:
+        result.close()
+    # NULL columns become NaN
+    return np.array(rows, dtype=np.float64).reshape(-1, columns)
+
+
+def _optional(value: float) -> Optional[float]:
+    return None if np.isnan(value) else float(value)
+
+
+def downsampled_value_history(session: Session, coin: str, points: int) -> List[Dict[str, Any]]:
+    """
+    At most `points` values of a coin, picked with LTTB on the USD value
+    """
+    query = session.query(
+        _unix_time(CoinValue.datetime), CoinValue.balance, CoinValue.usd_price, CoinValue.btc_price
+    ).filter(CoinValue.coin_id == coin)
+    query = filter_period(query, CoinValue).order_by(CoinValue.datetime.asc())
+    values = _fetch_array(session, query, 4)
+    times, balances = values[:, 0], values[:, 1]
+    usd_values = balances * values[:, 2]
+    btc_values = balances * values[:, 3]
+    return [
+        {
+            "balance": float(balances[i]),
+            "usd_value": _optional(usd_values[i]),
+            "btc_value": _optional(btc_values[i]),
+            "datetime": _datetime_of(times[i]).isoformat(),
+        }
+        for i in lttb(times, usd_values, points)
+    ]
 
 
 @app.route("/api/value_history/<coin>")
 @app.route("/api/value_history")
+@cache.cached("coin_value")
 def value_history(coin: str = None):
-    session: Session
-    with db.db_session() as session:
-        query = session.query(CoinValue).order_by(CoinValue.coin_id.asc(), CoinValue.datetime.asc())
-
-        query = filter_period(query, CoinValue)
-
+    def build_query(session: Session):
+        query = filter_period(session.query(CoinValue), CoinValue)
         if coin:
-            values: List[CoinValue] = query.filter(CoinValue.coin_id == coin).all()
-            return jsonify([entry.info() for entry in values])
+            query = query.filter(CoinValue.coin_id == coin)
+        return query
 
-        coin_values = groupby(query.all(), key=lambda cv: cv.coin)
-        return jsonify({coin.symbol: [entry.info() for entry in history] for coin, history in coin_values})
+    points = _requested_points()
+    if points is not None:
+        session: Session
+        with db.db_session() as session:
+            if coin:
+                return jsonify(downsampled_value_history(session, coin, points))
+            coin_ids = [coin_id for (coin_id,) in session.query(CoinValue.coin_id).distinct()]
+            return jsonify(
+                {coin_id: downsampled_value_history(session, coin_id, points) for coin_id in sorted(coin_ids)}
+            )
+
+    if coin:
+        return history_response(build_query, [CoinValue.datetime, CoinValue.id], CoinValue.info)
+    return history_response(
+        build_query,
+        [CoinValue.coin_id, CoinValue.datetime, CoinValue.id],
+        CoinValue.info,
+        group_by=lambda cv: cv.coin_id,
+    )
 
 
 @app.route("/api/total_value_history")
+@cache.cached("coin_value")
 def total_value_history():
     session: Session
     with db.db_session() as session:
@@ -74,60 +284,73 @@ def total_value_history():
 
         query = filter_period(query, CoinValue)
 
+        points = _requested_points()
+        if points is not None:
+            query = query.with_entities(
+                _unix_time(CoinValue.datetime), func.sum(CoinValue.btc_value), func.sum(CoinValue.usd_value)
+            ).order_by(CoinValue.datetime.asc())
+            totals = _fetch_array(session, query, 3)
+            return jsonify(
+                [
+                    {
+                        "datetime": _datetime_of(totals[i, 0]),
+                        "btc": _optional(totals[i, 1]),
+                        "usd": _optional(totals[i, 2]),
+                    }
+                    for i in lttb(totals[:, 0], totals[:, 2], points)
+                ]
+            )
+
         total_values: List[Tuple[datetime, float, float]] = query.all()
         return jsonify([{"datetime": tv[0], "btc": tv[1], "usd": tv[2]} for tv in total_values])
 
 
 @app.route("/api/trade_history")
+@cache.cached("trade_history")
 def trade_history():
-    session: Session
-    with db.db_session() as session:
-        query = session.query(Trade).order_by(Trade.datetime.asc())
-
-        query = filter_period(query, Trade)
-
-        trades: List[Trade] = query.all()
-        return jsonify([trade.info() for trade in trades])
+    return history_response(
+        lambda session: filter_period(session.query(Trade), Trade), [Trade.datetime, Trade.id], Trade.info
+    )
 
 
 @app.route("/api/scouting_history")
+@cache.cached("scout_history", "current_coin_history")
 def scouting_history():
     _current_coin = db.get_current_coin()
     coin = _current_coin.symbol if _current_coin is not None else None
-    session: Session
-    with db.db_session() as session:
+
+    def build_query(session: Session):
+        # The pair of each row comes from the join, its coins from the joined loads of Pair
         query = (
             session.query(ScoutHistory)
             .join(ScoutHistory.pair)
+            .options(contains_eager(ScoutHistory.pair))
             .filter(Pair.from_coin_id == coin)
-            .order_by(ScoutHistory.datetime.asc())
         )
+        return filter_period(query, ScoutHistory)
+
+    return history_response(build_query, [ScoutHistory.datetime, ScoutHistory.id], ScoutHistory.info)
 
-        query = filter_period(query, ScoutHistory)
 
-        scouts: List[ScoutHistory] = query.all()
-        return jsonify([scout.info() for scout in scouts])
+@app.route("/api/current_coin_history")
+@cache.cached("current_coin_history")
+def current_coin_history():
+    return history_response(
+        lambda session: filter_period(session.query(CurrentCoin), CurrentCoin),
+        [CurrentCoin.datetime, CurrentCoin.id],
+        CurrentCoin.info,
+    )
 
 
 @app.route("/api/current_coin")
+@cache.cached("current_coin_history")
 def current_coin():
     coin = db.get_current_coin()
     return coin.info() if coin else None
 
 
-@app.route("/api/current_coin_history")
-def current_coin_history():
-    session: Session
-    with db.db_session() as session:
-        query = session.query(CurrentCoin)
-
-        query = filter_period(query, CurrentCoin)
-
-        current_coins: List[CurrentCoin] = query.all()
-        return jsonify([cc.info() for cc in current_coins])
-
-
 @app.route("/api/coins")
+@cache.cached("coins", "current_coin_history")
 def coins():
     session: Session
     with db.db_session() as session:
@@ -137,6 +360,7 @@ def coins():
 
 
 @app.route("/api/pairs")
+@cache.cached("pairs", "trade_history", "current_coin_history")
 def pairs():
     session: Session
     with db.db_session() as session:
@@ -145,8 +369,9 @@ def pairs():
 
 
 @socketio.on("update", namespace="/backend")
-def handle_my_custom_event(json):
-    emit("update", json, namespace="/frontend", broadcast=True)
+def handle_my_custom_event(message):
+    cache.invalidate(message["table"])
+    emit("update", message, namespace="/frontend", broadcast=True)
 
 
 if __name__ == "__main__":
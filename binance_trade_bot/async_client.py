@@ -0,0 +1,104 @@
+import asyncio
+import functools
+import threading
+from typing import Any, Awaitable, List
+
+import aiohttp
+from binance import AsyncClient
+
+
+class AsyncBinanceClient:
+    """
+    Binance REST client running on an asyncio loop in a background thread.
+
+    Every request goes through a single aiohttp session, whose connector keeps up to `pool_size` keep-alive
+    connections open, so requests started together run concurrently instead of queuing behind each other.
+    Coroutines of the underlying AsyncClient are run with `run` or fanned out with `gather`.
+
+    Every AsyncClient method can also be called synchronously on this object, which blocks until the
+    response is received. That makes it a drop-in replacement of binance.client.Client for the code that
+    doesn't need concurrency. Synchronous calls must not be made from the loop thread itself.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        api_key: str = None,
+        api_secret: str = None,
+        tld="com",
+        testnet=False,
+        api_url: str = None,
+        pool_size=10,
+        timeout=30,
+        ping=True,
+    ):
+        """
+        :param api_url: Base URL of the REST API instead of Binance's, e.g. a local stand-in for tests
+        """
+        self.timeout = timeout
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="binance-async-client", daemon=True)
+        self._thread.start()
+        self.client: AsyncClient = self.run(self._create_client(api_key, api_secret, tld, testnet, api_url, pool_size))
+        if ping:
+            self.ping()
+
+    async def _create_client(  # pylint: disable=too-many-arguments
+        self, api_key: str, api_secret: str, tld: str, testnet: bool, api_url: str, pool_size: int
+    ) -> AsyncClient:
+        # The session and its connector must be created on the loop they run on
+        connector = aiohttp.TCPConnector(limit=pool_size, keepalive_timeout=60)
+        client = AsyncClient(
+            api_key,
+            api_secret,
+            tld=tld,
+            testnet=testnet,
+            loop=self._loop,
+            session_params={"connector": connector, "timeout": aiohttp.ClientTimeout(total=self.timeout)},
+        )
+        if api_url is not None:
+            client.API_URL = client.API_TESTNET_URL = api_url + "/api"
+            client.MARGIN_API_URL = api_url + "/sapi"
+        return client
+
+    def run(self, coroutine: Awaitable[Any]) -> Any:
+        """
+        Run a coroutine on the loop of the client and wait for its result
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def gather(self, *coroutines: Awaitable[Any]) -> List[Any]:
+        """
+        Run coroutines concurrently and wait for all their results, in the same order. The first exception
+        raised by one of them is raised once they're all done.
+        """
+
+        async def gather():
+            results = await asyncio.gather(*coroutines, return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            return results
+
+        return self.run(gather())
+
+    def close_connection(self):
+        if not self._loop.is_running():
+            return
+        self.run(self.client.close_connection())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __getattr__(self, name: str):
+        if name == "client":
+            # Not created yet
+            raise AttributeError(name)
+        attribute = getattr(self.client, name)
+        if not asyncio.iscoroutinefunction(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            return self.run(attribute(*args, **kwargs))
+
+        return call
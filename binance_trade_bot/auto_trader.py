@@ -1,6 +1,7 @@
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional
 
+import numpy as np
 from sqlalchemy.orm import Session
 
 from .binance_api_manager import BinanceAPIManager
@@ -8,6 +9,7 @@ from .config import Config
 from .database import Database
 from .logger import Logger
 from .models import Coin, CoinValue, Pair
+from .ratio_matrix import RatioMatrix
 
 
 class AutoTrader:
@@ -22,9 +24,20 @@ class AutoTrader:
         self.db = database
         self.logger = logger
         self.config = config
+        self.ratio_matrix: Optional[RatioMatrix] = None
+        self._fees_version = None
 
     def initialize(self):
         self.initialize_trade_thresholds()
+        self.initialize_ratio_matrix()
+
+    def initialize_ratio_matrix(self):
+        """
+        Load the enabled coins and their pair ratios into the ratio matrix used for scouting
+        """
+        self.ratio_matrix = RatioMatrix(coin.symbol for coin in self.db.get_coins())
+        self.ratio_matrix.load_pairs(self.db.get_pairs())
+        self._fees_version = None
 
     def transaction_through_bridge(self, pair: Pair):
         """
@@ -66,39 +79,49 @@ class AutoTrader:
             self.logger.info(f"Skipping update... current coin {coin + self.config.BRIDGE} not found")
             return
 
-        session: Session
-        with self.db.db_session() as session:
-            for pair in session.query(Pair).filter(Pair.to_coin == coin):
-                from_coin_price = self.manager.get_ticker_price(pair.from_coin + self.config.BRIDGE)
+        ratios: Dict[Pair, float] = {}
+        for pair in self.db.get_pairs_to(coin, only_enabled=False):
+            from_coin_price = self.manager.get_ticker_price(pair.from_coin + self.config.BRIDGE)
 
-                if from_coin_price is None:
-                    self.logger.info(f"Skipping update for coin {pair.from_coin + self.config.BRIDGE} not found")
-                    continue
+            if from_coin_price is None:
+                self.logger.info(f"Skipping update for coin {pair.from_coin + self.config.BRIDGE} not found")
+                continue
+
+            ratios[pair] = from_coin_price / coin_price
 
-                pair.ratio = from_coin_price / coin_price
+        self.db.update_pair_ratios(ratios)
+        self._update_ratio_matrix(ratios)
 
     def initialize_trade_thresholds(self):
         """
         Initialize the buying threshold of all the coins for trading between them
         """
-        session: Session
-        with self.db.db_session() as session:
-            for pair in session.query(Pair).filter(Pair.ratio.is_(None)).all():
-                if not pair.from_coin.enabled or not pair.to_coin.enabled:
-                    continue
-                self.logger.info(f"Initializing {pair.from_coin} vs {pair.to_coin}")
+        ratios: Dict[Pair, float] = {}
+        for pair in self.db.get_pairs():
+            if pair.ratio is not None:
+                continue
+            self.logger.info(f"Initializing {pair.from_coin} vs {pair.to_coin}")
 
-                from_coin_price = self.manager.get_ticker_price(pair.from_coin + self.config.BRIDGE)
-                if from_coin_price is None:
-                    self.logger.info(f"Skipping initializing {pair.from_coin + self.config.BRIDGE}, symbol not found")
-                    continue
+            from_coin_price = self.manager.get_ticker_price(pair.from_coin + self.config.BRIDGE)
+            if from_coin_price is None:
+                self.logger.info(f"Skipping initializing {pair.from_coin + self.config.BRIDGE}, symbol not found")
+                continue
 
-                to_coin_price = self.manager.get_ticker_price(pair.to_coin + self.config.BRIDGE)
-                if to_coin_price is None:
-                    self.logger.info(f"Skipping initializing {pair.to_coin + self.config.BRIDGE}, symbol not found")
-                    continue
+            to_coin_price = self.manager.get_ticker_price(pair.to_coin + self.config.BRIDGE)
+            if to_coin_price is None:
+                self.logger.info(f"Skipping initializing {pair.to_coin + self.config.BRIDGE}, symbol not found")
+                continue
+
+            ratios[pair] = from_coin_price / to_coin_price
 
-                pair.ratio = from_coin_price / to_coin_price
+        self.db.update_pair_ratios(ratios)
+        self._update_ratio_matrix(ratios)
+
+    def _update_ratio_matrix(self, ratios: Dict[Pair, float]):
+        if self.ratio_matrix is None:
+            return
+        for pair, ratio in ratios.items():
+            self.ratio_matrix.set_ratio(pair.from_coin_id, pair.to_coin_id, ratio)
 
     def scout(self):
         """
@@ -106,14 +129,64 @@ class AutoTrader:
         """
         raise NotImplementedError()
 
-    def _get_ratios(self, coin: Coin, coin_price):
+    def _scout_scores(self, coin: Coin = None, coin_price: float = None) -> np.ndarray:
+        """
+        Refresh the prices and fees held by the ratio matrix and compute the jump score of every pair
+        """
+        if self.ratio_matrix is None:
+            self.initialize_ratio_matrix()
+
+        coins = self.db.get_coins()
+        for matrix_coin in coins:
+            price = self.manager.get_ticker_price(matrix_coin + self.config.BRIDGE)
+            self.ratio_matrix.set_price(matrix_coin.symbol, price)
+        self._refresh_fees(coins)
+
+        if coin is not None and coin_price is not None:
+            self.ratio_matrix.set_price(coin.symbol, coin_price)
+
+        return self.ratio_matrix.scores(
+            self.config.USE_MARGIN == "yes", self.config.SCOUT_MULTIPLIER, self.config.SCOUT_MARGIN
+        )
+
+    def _refresh_fees(self, coins: List[Coin]):
+        """
+        Recompute the fees held by the ratio matrix, only for the coins that got a price since the last time
+        unless the state the fees depend on changed
+        """
+        version = self.manager.get_fees_version()
+        if version != self._fees_version:
+            self._fees_version = version
+            stale = coins
+        else:
+            stale = [
+                coin
+                for coin in coins
+                if not self.ratio_matrix.has_fees(coin.symbol) and self.ratio_matrix.get_price(coin.symbol) is not None
+            ]
+
+        for stale_coin in stale:
+            if self.ratio_matrix.get_price(stale_coin.symbol) is None:
+                self.ratio_matrix.set_fees(stale_coin.symbol, None, None)
+                continue
+            self.ratio_matrix.set_fees(
+                stale_coin.symbol,
+                self.manager.get_fee(stale_coin, self.config.BRIDGE, True),
+                self.manager.get_fee(stale_coin, self.config.BRIDGE, False),
+            )
+
+    def _get_ratios(self, coin: Coin, coin_price, scores: np.ndarray = None):
         """
         Given a coin, get the current price ratio for every other enabled coin
         """
+        if scores is None:
+            scores = self._scout_scores(coin, coin_price)
+        coin_scores = self.ratio_matrix.row(scores, coin.symbol)
+
         ratio_dict: Dict[Pair, float] = {}
 
         for pair in self.db.get_pairs_from(coin):
-            optional_coin_price = self.manager.get_ticker_price(pair.to_coin + self.config.BRIDGE)
+            optional_coin_price = self.ratio_matrix.get_price(pair.to_coin_id)
 
             if optional_coin_price is None:
                 self.logger.info(f"Skipping scouting... optional coin {pair.to_coin + self.config.BRIDGE} not found")
@@ -121,29 +194,18 @@ class AutoTrader:
 
             self.db.log_scout(pair, pair.ratio, coin_price, optional_coin_price)
 
-            # Obtain (current coin)/(optional coin)
-            coin_opt_coin_ratio = coin_price / optional_coin_price
-
-            # Fees
-            from_fee = self.manager.get_fee(pair.from_coin, self.config.BRIDGE, True)
-            to_fee = self.manager.get_fee(pair.to_coin, self.config.BRIDGE, False)
-            transaction_fee = from_fee + to_fee - from_fee * to_fee
-
-            if self.config.USE_MARGIN == "yes":
-                ratio_dict[pair] = (
-                    (1 - transaction_fee) * coin_opt_coin_ratio / pair.ratio - 1 - self.config.SCOUT_MARGIN / 100
-                )
-            else:
-                ratio_dict[pair] = (
-                    coin_opt_coin_ratio - transaction_fee * self.config.SCOUT_MULTIPLIER * coin_opt_coin_ratio
-                ) - pair.ratio
+            if coin_scores is None or pair.to_coin_id not in self.ratio_matrix:
+                continue
+            score = coin_scores[self.ratio_matrix.index[pair.to_coin_id]]
+            if not np.isnan(score):
+                ratio_dict[pair] = float(score)
         return ratio_dict
 
-    def _jump_to_best_coin(self, coin: Coin, coin_price: float):
+    def _jump_to_best_coin(self, coin: Coin, coin_price: float, scores: np.ndarray = None):
         """
         Given a coin, search for a coin to jump to
         """
-        ratio_dict = self._get_ratios(coin, coin_price)
+        ratio_dict = self._get_ratios(coin, coin_price, scores)
 
         # keep only ratios bigger than zero
         ratio_dict = {k: v for k, v in ratio_dict.items() if v > 0}
@@ -152,21 +214,23 @@ class AutoTrader:
         if ratio_dict:
             best_pair = max(ratio_dict, key=ratio_dict.get)
             self.logger.info(f"Will be jumping from {coin} to {best_pair.to_coin_id}")
-            self.transaction_through_bridge(best_pair)
+            return self.transaction_through_bridge(best_pair)
+        return None
 
     def bridge_scout(self):
         """
         If we have any bridge coin leftover, buy a coin with it that we won't immediately trade out of
         """
         bridge_balance = self.manager.get_currency_balance(self.config.BRIDGE.symbol)
+        scores = self._scout_scores()
 
         for coin in self.db.get_coins():
-            current_coin_price = self.manager.get_ticker_price(coin + self.config.BRIDGE)
+            current_coin_price = self.ratio_matrix.get_price(coin.symbol)
 
             if current_coin_price is None:
                 continue
 
-            ratio_dict = self._get_ratios(coin, current_coin_price)
+            ratio_dict = self._get_ratios(coin, current_coin_price, scores)
             if not any(v > 0 for v in ratio_dict.values()):
                 # There will only be one coin where all the ratios are negative. When we find it, buy it if we can
                 if bridge_balance > self.manager.get_min_notional(coin.symbol, self.config.BRIDGE.symbol):
@@ -198,6 +262,8 @@ class AutoTrader:
                 else:
                     usd_value = self.manager.get_ticker_price(coin + "USDT")
                     btc_value = self.manager.get_ticker_price(coin + "BTC")
-                cv = CoinValue(coin, balance, usd_value, btc_value, datetime=now)
+                cv = CoinValue(
+                    coin, balance, usd_value, btc_value, self.db.value_interval(coin.symbol, now), datetime=now
+                )
                 session.add(cv)
                 self.db.send_update(cv)
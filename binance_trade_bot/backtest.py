@@ -1,20 +1,23 @@
+import math
 from collections import defaultdict
 from datetime import datetime, timedelta
 from traceback import format_exc
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 
-from sqlitedict import SqliteDict
+import numpy as np
+from binance.client import Client
 
 from .binance_api_manager import BinanceAPIManager
 from .binance_stream_manager import BinanceOrder
 from .config import Config
 from .database import Database
+from .equity_curve import BacktestResult, EquityCurve
+from .kline_store import KlineStore, datetime_of, fetch_klines, minute_of, prefetch_klines
 from .logger import Logger
 from .models import Coin, Pair
+from .ratio_matrix import jump_scores
 from .strategies import get_strategy
 
-cache = SqliteDict("data/backtest_cache.db")
-
 
 class MockBinanceManager(BinanceAPIManager):
     def __init__(
@@ -24,17 +27,31 @@ class MockBinanceManager(BinanceAPIManager):
         logger: Logger,
         start_date: datetime = None,
         start_balances: Dict[str, float] = None,
+        klines: KlineStore = None,
+        binance_client: Client = None,
     ):
-        super().__init__(config, db, logger)
+        super().__init__(config, db, logger, binance_client=binance_client)
         self.config = config
         self.datetime = start_date or datetime(2021, 1, 1)
+        self.minute = minute_of(self.datetime)
         self.balances = start_balances or {config.BRIDGE.symbol: 100}
+        self.klines = klines or KlineStore()
+
+        self.equity: Optional[EquityCurve] = None
+        self.trade_count = 0
+        # In bridge terms
+        self.traded_volume = 0.0
+        self.fees_paid = 0.0
 
     def setup_websockets(self):
         pass  # No websockets are needed for backtesting
 
     def increment(self, interval=1):
         self.datetime += timedelta(minutes=interval)
+        self.minute += interval
+
+    def get_fees_version(self):
+        return 0
 
     def get_fee(self, origin_coin: Coin, target_coin: Coin, selling: bool):
         return 0.00075
@@ -43,24 +60,22 @@ class MockBinanceManager(BinanceAPIManager):
         """
         Get ticker price of a specific coin
         """
-        target_date = self.datetime.strftime("%d %b %Y %H:%M:%S")
-        key = f"{ticker_symbol} - {target_date}"
-        val = cache.get(key, None)
-        if val is None:
-            end_date = self.datetime + timedelta(minutes=1000)
-            if end_date > datetime.now():
-                end_date = datetime.now()
-            end_date = end_date.strftime("%d %b %Y %H:%M:%S")
-            self.logger.info(f"Fetching prices for {ticker_symbol} between {self.datetime} and {end_date}")
-            for result in self.binance_client.get_historical_klines(
-                ticker_symbol, "1m", target_date, end_date, limit=1000
-            ):
-                date = datetime.utcfromtimestamp(result[0] / 1000).strftime("%d %b %Y %H:%M:%S")
-                price = float(result[1])
-                cache[f"{ticker_symbol} - {date}"] = price
-            cache.commit()
-            val = cache.get(key, None)
-        return val
+        price = self.klines.price(ticker_symbol, self.minute)
+        if price is None and not self.klines.read_only and not self.klines.is_fetched(ticker_symbol, self.minute):
+            self.fetch_klines(ticker_symbol, self.minute, self.minute + 1000)
+            price = self.klines.price(ticker_symbol, self.minute)
+        return price
+
+    def fetch_klines(self, ticker_symbol: str, start: int, end: int):
+        """
+        Fetch the one minute prices of a symbol for the minutes [start, end) into the kline store
+        """
+        end = min(end, minute_of(datetime.utcnow()))
+        if end <= start:
+            return
+        self.logger.info(f"Fetching prices for {ticker_symbol} between {datetime_of(start)} and {datetime_of(end)}")
+        fetch_klines(self.klines, self.binance_client, ticker_symbol, start, end)
+        self.klines.flush()
 
     def get_currency_balance(self, currency_symbol: str, force=False):
         """
@@ -68,6 +83,15 @@ class MockBinanceManager(BinanceAPIManager):
         """
         return self.balances.get(currency_symbol, 0)
 
+    def get_total_balance(self, currency_symbol: str):
+        """
+        Get total balance of a specific coin, there are no locked amounts when backtesting
+        """
+        return self.get_currency_balance(currency_symbol)
+
+    def get_total_balances(self):
+        return dict(self.balances)
+
     def buy_alt(self, origin_coin: Coin, target_coin: Coin):
         origin_symbol = origin_coin.symbol
         target_symbol = target_coin.symbol
@@ -77,10 +101,10 @@ class MockBinanceManager(BinanceAPIManager):
 
         order_quantity = self._buy_quantity(origin_symbol, target_symbol, target_balance, from_coin_price)
         target_quantity = order_quantity * from_coin_price
+        fee = self.get_fee(origin_coin, target_coin, False)
         self.balances[target_symbol] -= target_quantity
-        self.balances[origin_symbol] = self.balances.get(origin_symbol, 0) + order_quantity * (
-            1 - self.get_fee(origin_coin, target_coin, False)
-        )
+        self.balances[origin_symbol] = self.balances.get(origin_symbol, 0) + order_quantity * (1 - fee)
+        self._record_trade(target_symbol, target_quantity, fee)
         self.logger.info(
             f"Bought {origin_symbol}, balance now: {self.balances[origin_symbol]} - bridge: "
             f"{self.balances[target_symbol]}"
@@ -103,16 +127,59 @@ class MockBinanceManager(BinanceAPIManager):
 
         order_quantity = self._sell_quantity(origin_symbol, target_symbol, origin_balance)
         target_quantity = order_quantity * from_coin_price
-        self.balances[target_symbol] = self.balances.get(target_symbol, 0) + target_quantity * (
-            1 - self.get_fee(origin_coin, target_coin, True)
-        )
+        fee = self.get_fee(origin_coin, target_coin, True)
+        self.balances[target_symbol] = self.balances.get(target_symbol, 0) + target_quantity * (1 - fee)
         self.balances[origin_symbol] -= order_quantity
+        self._record_trade(target_symbol, target_quantity, fee)
         self.logger.info(
             f"Sold {origin_symbol}, balance now: {self.balances[origin_symbol]} - bridge: "
             f"{self.balances[target_symbol]}"
         )
         return {"price": from_coin_price}
 
+    def _record_trade(self, quote_symbol: str, quote_quantity: float, fee: float):
+        volume = quote_quantity
+        if quote_symbol != self.config.BRIDGE.symbol:
+            price = self.get_ticker_price(quote_symbol + self.config.BRIDGE.symbol)
+            volume = quote_quantity * price if price is not None else 0.0
+        self.trade_count += 1
+        self.traded_volume += volume
+        self.fees_paid += volume * fee
+
+    def portfolio_values(self) -> Tuple[float, float]:
+        """
+        Value of the balances in bridge and BTC terms, with one price lookup per held coin
+        """
+        bridge_symbol = self.config.BRIDGE.symbol
+        bridge_value = 0.0
+        for coin, balance in self.balances.items():
+            if not balance:
+                continue
+            if coin == bridge_symbol:
+                bridge_value += balance
+                continue
+            price = self.get_ticker_price(coin + bridge_symbol)
+            if price is not None:
+                bridge_value += price * balance
+        btc_price = self.get_ticker_price("BTC" + bridge_symbol)
+        return bridge_value, bridge_value / btc_price if btc_price else float("nan")
+
+    def record_equity(self):
+        if self.equity is None:
+            return
+        if self.equity.size and self.equity.minutes[self.equity.size - 1] == self.minute:
+            return
+        self.equity.append(self.minute, *self.portfolio_values())
+
+    def result(self) -> BacktestResult:
+        return BacktestResult(
+            self.equity,
+            self.trade_count,
+            self.traded_volume,
+            self.fees_paid,
+            {coin: balance for coin, balance in self.balances.items() if balance},
+        )
+
     def collate_coins(self, target_symbol: str):
         total = 0
         for coin, balance in self.balances.items():
@@ -146,6 +213,93 @@ class MockDatabase(Database):
         pass
 
 
+class ScoutEventFinder:
+    """
+    Finds the next scout of the default strategy that can act, from the price arrays of the kline store.
+
+    Between two jumps the balances, pair ratios and fees are fixed, so a scout can only do something at a
+    minute where the jump score of a pair from the current coin is positive, or where the value of the
+    current coin fell low enough for a bridge scout. Both are computed for a whole window of minutes at
+    once, with the same formulas as the scout, and every scout before the first such minute is skipped.
+    """
+
+    def __init__(self, trader, manager: MockBinanceManager, db: Database, config: Config, window=1440):
+        self.trader = trader
+        self.manager = manager
+        self.db = db
+        self.config = config
+        self.window = window
+
+    def _prices(self, symbol: str, minutes: np.ndarray) -> np.ndarray:
+        array = self.manager.klines.array(symbol)
+        prices = np.full(len(minutes), np.nan)
+        stored = minutes < len(array)
+        prices[stored] = array[minutes[stored]]
+        # 0 is a missing price
+        prices[prices <= 0] = np.nan
+        return prices
+
+    def idle_steps(self, minute: int, step: int, max_steps: int) -> int:
+        """
+        Number of scouts, `step` minutes apart from `minute` on, that can't act, up to `max_steps`
+        """
+        bridge = self.config.BRIDGE
+        coin = self.db.get_current_coin()
+        matrix = self.trader.ratio_matrix
+        if coin is None or coin.symbol == bridge.symbol or matrix is None or coin.symbol not in matrix:
+            # The scout has no price to work with
+            return max_steps
+
+        i = matrix.index[coin.symbol]
+        targets = [j for j in range(len(matrix)) if j != i and not np.isnan(matrix.ratios[i, j])]
+        ratios = matrix.ratios[i, targets]
+        sell_fee = self.manager.get_fee(coin, bridge, True)
+        buy_fees = np.array([self.manager.get_fee(self.db.get_coin(matrix.symbols[j]), bridge, False) for j in targets])
+        transaction_fee = sell_fee + buy_fees - sell_fee * buy_fees
+
+        balance = self.manager.get_total_balance(coin.symbol)
+        min_notional = self.manager.get_min_notional(coin.symbol, bridge.symbol)
+
+        for window_start in range(0, max_steps, self.window):
+            steps = np.arange(window_start, min(max_steps, window_start + self.window))
+            minutes = minute + steps * step
+            coin_prices = self._prices(coin.symbol + bridge.symbol, minutes)
+            with np.errstate(invalid="ignore"):
+                if min_notional is not None:
+                    # The value of the current coin fell under the dust threshold of the scout
+                    can_act = balance * coin_prices < min_notional * 0.8
+                else:
+                    can_act = np.zeros(len(steps), dtype=bool)
+                if targets:
+                    other_prices = np.stack(
+                        [self._prices(matrix.symbols[j] + bridge.symbol, minutes) for j in targets], axis=1
+                    )
+                    scores = jump_scores(
+                        coin_prices[:, np.newaxis] / other_prices,
+                        transaction_fee,
+                        ratios,
+                        self.config.USE_MARGIN == "yes",
+                        self.config.SCOUT_MULTIPLIER,
+                        self.config.SCOUT_MARGIN,
+                    )
+                    can_act |= (scores > 0).any(axis=1)
+            if can_act.any():
+                return int(steps[np.argmax(can_act)])
+        return max_steps
+
+
+def backtest_symbols(config: Config) -> List[str]:
+    """
+    Every symbol whose prices a backtest reads: each coin against the bridge, and against BTC to value
+    the balances in BTC
+    """
+    symbols = [coin + config.BRIDGE.symbol for coin in config.SUPPORTED_COIN_LIST]
+    symbols += [coin + "BTC" for coin in config.SUPPORTED_COIN_LIST if coin != "BTC"]
+    if "BTC" + config.BRIDGE.symbol not in symbols:
+        symbols.append("BTC" + config.BRIDGE.symbol)
+    return symbols
+
+
 def backtest(
     start_date: datetime = None,
     end_date: datetime = None,
@@ -154,6 +308,10 @@ def backtest(
     start_balances: Dict[str, float] = None,
     starting_coin: str = None,
     config: Config = None,
+    binance_client: Client = None,
+    prefetch=True,
+    klines: KlineStore = None,
+    fast=False,
 ):
     """
 
@@ -164,8 +322,14 @@ def backtest(
     :param yield_interval: After how many intervals should the manager be yielded
     :param start_balances: A dictionary of initial coin values. Default: {BRIDGE: 100}
     :param starting_coin: The coin to start on. Default: first coin in coin list
-
-    :return: The final coin balances
+    :param binance_client: Client to fetch the historical prices from. Default: a new binance Client
+    :param prefetch: Download every price of the backtest period concurrently before replaying it
+    :param klines: Store to read the prices from. A read-only store is never fetched into. Default: data/klines
+    :param fast: Skip the scouts that can't act, found from the stored prices. Only for the default strategy,
+        and every price must already be in the store (prefetched, or a read-only store).
+
+    :return: Yields the manager every `yield_interval` scouts, and once more at the end. Its equity curve gets
+        a point at each yield, and manager.result() holds the metrics of the run.
     """
     config = config or Config()
     logger = Logger("backtesting", enable_notifications=False)
@@ -175,7 +339,13 @@ def backtest(
     db = MockDatabase(logger, config)
     db.create_database()
     db.set_coins(config.SUPPORTED_COIN_LIST)
-    manager = MockBinanceManager(config, db, logger, start_date, start_balances)
+    klines = klines or KlineStore()
+    manager = MockBinanceManager(config, db, logger, start_date, start_balances, klines, binance_client)
+    steps = max(0, math.ceil((end_date - manager.datetime) / timedelta(minutes=interval)))
+    manager.equity = EquityCurve(interval * yield_interval, capacity=steps // yield_interval + 2)
+
+    if prefetch and not klines.read_only:
+        prefetch_klines(klines, manager.binance_client, backtest_symbols(config), manager.datetime, end_date, logger)
 
     starting_coin = db.get_coin(starting_coin or config.SUPPORTED_COIN_LIST[0])
     if manager.get_currency_balance(starting_coin.symbol) == 0:
@@ -189,20 +359,47 @@ def backtest(
     trader = strategy(manager, db, logger, config)
     trader.initialize()
 
+    finder = None
+    if fast:
+        if config.STRATEGY == "default":
+            finder = ScoutEventFinder(trader, manager, db, config)
+        else:
+            logger.warning(
+                f"Fast backtests only support the default strategy, replaying every scout of {config.STRATEGY}"
+            )
+
+    manager.record_equity()
     yield manager
 
     n = 1
     try:
         while manager.datetime < end_date:
+            if finder is not None:
+                # Skip up to the next scout that can act, stopping at the next yield
+                remaining = math.ceil((end_date - manager.datetime) / timedelta(minutes=interval))
+                until_yield = yield_interval - (n - 1) % yield_interval
+                idle = finder.idle_steps(manager.minute, interval, min(remaining, until_yield))
+                if idle:
+                    manager.increment(idle * interval)
+                    n += idle
+                    if (n - 1) % yield_interval == 0:
+                        manager.record_equity()
+                        yield manager
+                    continue
             try:
                 trader.scout()
             except Exception:  # pylint: disable=broad-except
                 logger.warning(format_exc())
             manager.increment(interval)
             if n % yield_interval == 0:
+                manager.record_equity()
                 yield manager
             n += 1
     except KeyboardInterrupt:
         pass
-    cache.close()
+    klines.flush()
+
+    if manager.equity.minutes[manager.equity.size - 1] != manager.minute:
+        manager.record_equity()
+        yield manager
     return manager
@@ -1,34 +1,73 @@
 import math
 import time
 import traceback
-from typing import Dict, Optional
+from typing import Any, Dict, Hashable, Optional, Tuple
 
 from binance.client import Client
 from binance.exceptions import BinanceAPIException
 from cachetools import TTLCache, cached
+from prometheus_client import Counter, Histogram
 
+from .async_client import AsyncBinanceClient
 from .binance_stream_manager import BinanceCache, BinanceOrder, BinanceStreamManager, OrderGuard
 from .config import Config
 from .database import Database
+from .exchange_info import ExchangeInfo, SymbolInfo
 from .logger import Logger
 from .models import Coin
+from .rate_limiter import REQUEST_DURATION, REQUEST_ERRORS, RequestScheduler, ScheduledClient, request_weight
+
+# Longest wait for an order update before logging that we're still waiting
+ORDER_WAIT_LOG_INTERVAL = 10
+
+# Seconds between account requests while waiting for the balance of a sold coin to go down
+BALANCE_POLL_INTERVAL = 1
+
+ORDER_FILL_DURATION = Histogram(
+    "order_fill_duration_seconds",
+    "Time from placing an order to it being filled, by side",
+    ["side"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+ORDERS_CANCELED = Counter("orders_canceled_total", "Orders that were canceled instead of being filled")
+
+
+async def _timed_request(method: str, coroutine):
+    start = time.perf_counter()
+    try:
+        return await coroutine
+    except BinanceAPIException as e:
+        REQUEST_ERRORS.labels(method, e.status_code).inc()
+        raise
+    finally:
+        REQUEST_DURATION.labels(method).observe(time.perf_counter() - start)
 
 
 class BinanceAPIManager:
-    def __init__(self, config: Config, db: Database, logger: Logger, testnet = False):
-        # initializing the client class calls `ping` API endpoint, verifying the connection
-        self.binance_client = Client(
-            config.BINANCE_API_KEY,
-            config.BINANCE_API_SECRET_KEY,
-            tld=config.BINANCE_TLD,
-            testnet=testnet,
+    def __init__(self, config: Config, db: Database, logger: Logger, testnet = False, binance_client: Client = None):
+        # Every request goes through the scheduler, which keeps the request weight under the limit and lets
+        # orders get ahead of the informational reads
+        self.scheduler = RequestScheduler()
+        # initializing the client class calls `ping` API endpoint, verifying the connection. Its synchronous
+        # methods are the same as Client's, and independent requests can be sent concurrently through it.
+        self.binance_client = ScheduledClient(
+            binance_client
+            or AsyncBinanceClient(
+                config.BINANCE_API_KEY,
+                config.BINANCE_API_SECRET_KEY,
+                tld=config.BINANCE_TLD,
+                testnet=testnet,
+            ),
+            self.scheduler,
         )
         self.db = db
         self.logger = logger
         self.config = config
         self.testnet = testnet
+        self._trade_fees_version = 0
 
         self.cache = BinanceCache()
+        self.exchange_info = ExchangeInfo(self.binance_client, self.logger)
         self.stream_manager: Optional[BinanceStreamManager] = None
         self.setup_websockets()
 
@@ -42,23 +81,31 @@ class BinanceAPIManager:
 
     @cached(cache=TTLCache(maxsize=1, ttl=43200))
     def get_trade_fees(self) -> Dict[str, float]:
+        self._trade_fees_version += 1
         if not self.testnet:
             return {ticker["symbol"]: float(ticker["takerCommission"]) for ticker in self.binance_client.get_trade_fee()}
 
 
         ## testnet does not provide trade fee API, emulating it
-        exchange_info = self.binance_client.get_exchange_info()
-        symbols = exchange_info["symbols"]
-        return {
-            symbol["symbol"]: 0.001
-            for symbol in symbols
-        }
+        return {symbol: 0.001 for symbol in self.exchange_info.symbols()}
 
 
     @cached(cache=TTLCache(maxsize=1, ttl=60))
     def get_using_bnb_for_fees(self):
         return self.binance_client.get_bnb_burn_spot_margin()["spotBNBBurn"]
 
+    def get_fees_version(self) -> Hashable:
+        """
+        Key of the state the results of get_fee depend on: the trade fee snapshot, whether BNB pays for the
+        fees and, when it does, the balances that decide if the BNB discount applies. Fees computed while
+        the key stays the same can be reused.
+        """
+        self.get_trade_fees()
+        if not self.testnet and not self.get_using_bnb_for_fees():
+            return self._trade_fees_version, False
+        with self.cache.open_balances() as balances:
+            return self._trade_fees_version, True, tuple(sorted(balances.items()))
+
     def get_fee(self, origin_coin: Coin, target_coin: Coin, selling: bool):
         base_fee = self.get_trade_fees()[origin_coin + target_coin]
         if not self.testnet:
@@ -93,6 +140,64 @@ class BinanceAPIManager:
         """
         return self.binance_client.get_account()
 
+    def close(self):
+        self.binance_client.client.close_connection()
+
+    def fetch_concurrently(self, **requests: Tuple[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Send independent requests at once, e.g. fetch_concurrently(account=("get_account", {})), and return
+        their responses by name. They're sent one after the other when the client can't fan out.
+        """
+        client = self.binance_client.client
+        if not isinstance(client, AsyncBinanceClient):
+            return {name: getattr(self.binance_client, method)(**kwargs) for name, (method, kwargs) in requests.items()}
+
+        # The requests leave together, so their total weight is waited for at once
+        self.scheduler.acquire(sum(request_weight(method) for method, _ in requests.values()))
+        try:
+            responses = client.gather(
+                *(
+                    _timed_request(method, getattr(client.client, method)(**kwargs))
+                    for method, kwargs in requests.values()
+                )
+            )
+        except BinanceAPIException as e:
+            self.scheduler.handle_exception(e)
+            raise
+        finally:
+            self.scheduler.update_used_weight(client.client.response)
+        return dict(zip(requests, responses))
+
+    def warm_up(self):
+        """
+        Fill the balances, ticker prices and exchange info with concurrent requests, so that the first scout
+        and the initialization of the strategy don't fetch them one after the other
+        """
+        responses = self.fetch_concurrently(
+            account=("get_account", {}),
+            tickers=("get_symbol_ticker", {}),
+            exchange_info=("get_exchange_info", {}),
+        )
+        with self.cache.open_balances() as cache_balances:
+            self._update_balances(cache_balances, responses["account"])
+        self.cache.ticker_values = {ticker["symbol"]: float(ticker["price"]) for ticker in responses["tickers"]}
+        self.exchange_info.load(responses["exchange_info"])
+
+    def _update_balances(self, cache_balances: Dict[str, float], account: Dict[str, Any]):
+        cache_balances.clear()
+        cache_balances.update(
+            {currency_balance["asset"]: float(currency_balance["free"]) for currency_balance in account["balances"]}
+        )
+        with self.cache.open_total_balances() as total_balances:
+            total_balances.clear()
+            total_balances.update(
+                {
+                    currency_balance["asset"]: float(currency_balance["free"]) + float(currency_balance["locked"])
+                    for currency_balance in account["balances"]
+                }
+            )
+        self.logger.debug(f"Fetched all balances: {cache_balances}")
+
     def get_ticker_price(self, ticker_symbol: str):
         """
         Get ticker price of a specific coin
@@ -125,14 +230,7 @@ class BinanceAPIManager:
         with self.cache.open_balances() as cache_balances:
             balance = cache_balances.get(currency_symbol, None)
             if force or balance is None:
-                cache_balances.clear()
-                cache_balances.update(
-                    {
-                        currency_balance["asset"]: float(currency_balance["free"])
-                        for currency_balance in self.binance_client.get_account()["balances"]
-                    }
-                )
-                self.logger.debug(f"Fetched all balances: {cache_balances}")
+                self._update_balances(cache_balances, self.binance_client.get_account())
                 if currency_symbol not in cache_balances:
                     cache_balances[currency_symbol] = 0.0
                     return 0.0
@@ -146,17 +244,32 @@ class BinanceAPIManager:
         """
         Get total balance (free + locked) of a specific coin
         """
-        # We need to fetch fresh data to include locked amounts, as cache might only store 'free'
-        # based on current implementation of get_currency_balance
+        # Kept up to date by the account updates of the user data stream, so scouting on every ticker
+        # doesn't cost an account request each time
+        with self.cache.open_total_balances() as total_balances:
+            balance = total_balances.get(currency_symbol, None)
+        if balance is not None:
+            return balance
+        balances = self.get_total_balances()
+        if balances:
+            # Not holding a coin doesn't make it fetched again on the next call
+            with self.cache.open_total_balances() as total_balances:
+                total_balances.setdefault(currency_symbol, 0.0)
+        return balances.get(currency_symbol, 0.0)
+
+    def get_total_balances(self) -> Dict[str, float]:
+        """
+        Get the total balance (free + locked) of every coin with a single request, which also refreshes the
+        cached balances
+        """
         try:
-             account = self.binance_client.get_account()
-             for balance in account["balances"]:
-                 if balance["asset"] == currency_symbol:
-                     return float(balance["free"]) + float(balance["locked"])
-             return 0.0
-        except Exception as e:
-            self.logger.warning(f"Failed to fetch total balance for {currency_symbol}: {e}")
-            return 0.0
+            account = self.binance_client.get_account()
+        except Exception as e:  # pylint: disable=broad-except
+            self.logger.warning(f"Failed to fetch total balances: {e}")
+            return {}
+        with self.cache.open_balances() as cache_balances:
+            self._update_balances(cache_balances, account)
+        return {balance["asset"]: float(balance["free"]) + float(balance["locked"]) for balance in account["balances"]}
 
     def retry(self, func, *args, **kwargs):
         for attempt in range(20):
@@ -169,40 +282,31 @@ class BinanceAPIManager:
                 time.sleep(1)
         return None
 
+    def get_symbol_info(self, origin_symbol: str, target_symbol: str) -> SymbolInfo:
+        return self.exchange_info[origin_symbol + target_symbol]
+
     def get_symbol_filter(self, origin_symbol: str, target_symbol: str, filter_type: str):
-        return next(
-            _filter
-            for _filter in self.binance_client.get_symbol_info(origin_symbol + target_symbol)["filters"]
-            if _filter["filterType"] == filter_type
-        )
+        return self.get_symbol_info(origin_symbol, target_symbol).filters[filter_type]
 
-    @cached(cache=TTLCache(maxsize=2000, ttl=43200))
     def get_alt_tick(self, origin_symbol: str, target_symbol: str):
-        step_size = self.get_symbol_filter(origin_symbol, target_symbol, "LOT_SIZE")["stepSize"]
-        if step_size.find("1") == 0:
-            return 1 - step_size.find(".")
-        return step_size.find("1") - 1
+        return self.get_symbol_info(origin_symbol, target_symbol).alt_tick
 
-    @cached(cache=TTLCache(maxsize=2000, ttl=43200))
     def get_min_notional(self, origin_symbol: str, target_symbol: str):
-        return float(self.get_symbol_filter(origin_symbol, target_symbol, "NOTIONAL")["minNotional"])
+        return self.get_symbol_info(origin_symbol, target_symbol).min_notional
 
     def _wait_for_order(
         self, order_id, origin_symbol: str, target_symbol: str
     ) -> Optional[BinanceOrder]:  # pylint: disable=unsubscriptable-object
-        while True:
-            order_status: BinanceOrder = self.cache.orders.get(order_id, None)
-            if order_status is not None:
-                break
+        # Updates received from here on are noticed by the waits, even those arriving before a wait starts
+        order_status, version = self.cache.get_order(order_id)
+        while order_status is None:
             self.logger.debug(f"Waiting for order {order_id} to be created")
-            time.sleep(1)
+            order_status, version = self.cache.wait_for_order_update(order_id, version, ORDER_WAIT_LOG_INTERVAL)
 
         self.logger.debug(f"Order created: {order_status}")
 
         while order_status.status != "FILLED":
             try:
-                order_status = self.cache.orders.get(order_id, None)
-
                 self.logger.debug(f"Waiting for order {order_id} to be filled")
 
                 if self._should_cancel_order(order_status):
@@ -232,13 +336,16 @@ class BinanceAPIManager:
                     self.logger.info("Order is canceled, going back to scouting mode...")
                     return None
 
-                time.sleep(1)
+                # Sleep until the order is updated or it's time to check whether to cancel it
+                order_status, version = self.cache.wait_for_order_update(
+                    order_id, version, self._cancel_check_timeout(order_status)
+                )
             except BinanceAPIException as e:
                 self.logger.info(e)
-                time.sleep(1)
+                order_status, version = self.cache.wait_for_order_update(order_id, version, 1)
             except Exception as e:  # pylint: disable=broad-except
                 self.logger.info(f"Unexpected Error: {e}")
-                time.sleep(1)
+                order_status, version = self.cache.wait_for_order_update(order_id, version, 1)
 
         self.logger.debug(f"Order filled: {order_status}")
         return order_status
@@ -246,17 +353,36 @@ class BinanceAPIManager:
     def wait_for_order(
         self, order_id, origin_symbol: str, target_symbol: str, order_guard: OrderGuard
     ) -> Optional[BinanceOrder]:  # pylint: disable=unsubscriptable-object
+        start = time.perf_counter()
         with order_guard:
-            return self._wait_for_order(order_id, origin_symbol, target_symbol)
+            order = self._wait_for_order(order_id, origin_symbol, target_symbol)
+        if order is None:
+            ORDERS_CANCELED.inc()
+        else:
+            ORDER_FILL_DURATION.labels(order.side).observe(time.perf_counter() - start)
+        return order
+
+    def _order_timeout(self, order_status: BinanceOrder) -> float:
+        if order_status.side == "SELL":
+            return float(self.config.SELL_TIMEOUT)
+        return float(self.config.BUY_TIMEOUT)
+
+    def _cancel_check_timeout(self, order_status: BinanceOrder) -> float:
+        """
+        Seconds until _should_cancel_order needs to run again for an order that didn't change
+        """
+        timeout = self._order_timeout(order_status)
+        if not timeout:
+            return ORDER_WAIT_LOG_INTERVAL
+        until_timeout = order_status.time / 1000 + timeout * 60 - time.time()
+        if until_timeout > 0:
+            return min(until_timeout, ORDER_WAIT_LOG_INTERVAL)
+        # Past the timeout, a partially filled buy is canceled once the price moves away
+        return 1
 
     def _should_cancel_order(self, order_status):
         minutes = (time.time() - order_status.time / 1000) / 60
-        timeout = 0
-
-        if order_status.side == "SELL":
-            timeout = float(self.config.SELL_TIMEOUT)
-        else:
-            timeout = float(self.config.BUY_TIMEOUT)
+        timeout = self._order_timeout(order_status)
 
         if timeout and minutes > timeout and order_status.status == "NEW":
             return True
@@ -301,12 +427,12 @@ class BinanceAPIManager:
 
         origin_balance = self.get_currency_balance(origin_symbol)
         target_balance = self.get_currency_balance(target_symbol)
-        pair_info = self.binance_client.get_symbol_info(origin_symbol + target_symbol)
+        pair_info = self.get_symbol_info(origin_symbol, target_symbol)
         from_coin_price = self.get_ticker_price(origin_symbol + target_symbol)
-        from_coin_price_s = "{:0.0{}f}".format(from_coin_price, pair_info["quotePrecision"])
+        from_coin_price_s = "{:0.0{}f}".format(from_coin_price, pair_info.quote_precision)
 
         order_quantity = self._buy_quantity(origin_symbol, target_symbol, target_balance, from_coin_price)
-        order_quantity_s = "{:0.0{}f}".format(order_quantity, pair_info["baseAssetPrecision"])
+        order_quantity_s = "{:0.0{}f}".format(order_quantity, pair_info.base_asset_precision)
 
         self.logger.info(f"BUY QTY {order_quantity}")
 
@@ -371,12 +497,12 @@ class BinanceAPIManager:
         origin_balance = self.get_currency_balance(origin_symbol)
         target_balance = self.get_currency_balance(target_symbol)
 
-        pair_info = self.binance_client.get_symbol_info(origin_symbol + target_symbol)
+        pair_info = self.get_symbol_info(origin_symbol, target_symbol)
         from_coin_price = self.get_ticker_price(origin_symbol + target_symbol)
-        from_coin_price_s = "{:0.0{}f}".format(from_coin_price, pair_info["quotePrecision"])
+        from_coin_price_s = "{:0.0{}f}".format(from_coin_price, pair_info.quote_precision)
 
         order_quantity = self._sell_quantity(origin_symbol, target_symbol, origin_balance)
-        order_quantity_s = "{:0.0{}f}".format(order_quantity, pair_info["baseAssetPrecision"])
+        order_quantity_s = "{:0.0{}f}".format(order_quantity, pair_info.base_asset_precision)
         self.logger.info(f"Selling {order_quantity} of {origin_symbol}")
 
         self.logger.info(f"Balance is {origin_balance}")
@@ -413,6 +539,8 @@ class BinanceAPIManager:
 
         new_balance = self.get_currency_balance(origin_symbol)
         while new_balance >= origin_balance:
+            # The balance update usually arrives on the user data stream first, don't spin on account requests
+            time.sleep(BALANCE_POLL_INTERVAL)
             new_balance = self.get_currency_balance(origin_symbol, True)
 
         self.logger.info(f"Sold {origin_symbol}")
@@ -1,16 +1,25 @@
-import sys
+import queue
 import threading
 import time
 from contextlib import contextmanager
-from typing import Dict, Set, Tuple
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
 
 import binance.client
 from binance.exceptions import BinanceAPIException, BinanceRequestException
+from prometheus_client import Gauge, Histogram
 from unicorn_binance_websocket_api import BinanceWebSocketApiManager
 
 from .config import Config
 from .logger import Logger
 
+STREAM_EVENT_LAG = Histogram(
+    "stream_event_lag_seconds",
+    "Time from Binance sending a stream event to the bot processing it, by event type",
+    ["event_type"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+STREAM_QUEUE_DEPTH = Gauge("stream_queue_depth", "Stream events and signals waiting to be processed")
+
 
 class BinanceOrder:  # pylint: disable=too-few-public-methods
     def __init__(self, report):
@@ -32,14 +41,53 @@ class BinanceCache:  # pylint: disable=too-few-public-methods
     ticker_values: Dict[str, float] = {}
     _balances: Dict[str, float] = {}
     _balances_mutex: threading.Lock = threading.Lock()
+    # Free + locked, taken after _balances_mutex when both are needed
+    _total_balances: Dict[str, float] = {}
+    _total_balances_mutex: threading.Lock = threading.Lock()
     non_existent_tickers: Set[str] = set()
     orders: Dict[str, BinanceOrder] = {}
+    # Number of updates received per order, which tells a waiter whether it missed one
+    _order_versions: Dict[str, int] = {}
+    _orders_condition: threading.Condition = threading.Condition()
 
     @contextmanager
     def open_balances(self):
         with self._balances_mutex:
             yield self._balances
 
+    @contextmanager
+    def open_total_balances(self):
+        with self._total_balances_mutex:
+            yield self._total_balances
+
+    def update_order(self, order: BinanceOrder):
+        """
+        Store the latest state of an order and wake up whoever waits for it
+        """
+        with self._orders_condition:
+            self.orders[order.id] = order
+            self._order_versions[order.id] = self._order_versions.get(order.id, 0) + 1
+            self._orders_condition.notify_all()
+
+    def get_order(self, order_id) -> Tuple[Optional[BinanceOrder], int]:
+        """
+        The latest state of an order, None while nothing was heard of it yet, and its version to pass to
+        `wait_for_order_update`
+        """
+        with self._orders_condition:
+            return self.orders.get(order_id, None), self._order_versions.get(order_id, 0)
+
+    def wait_for_order_update(
+        self, order_id, version: int, timeout: Optional[float]
+    ) -> Tuple[Optional[BinanceOrder], int]:
+        """
+        Wait up to `timeout` seconds for the order to be updated past `version`, and return its latest state
+        and version like `get_order`. Returns at once if an update arrived since that version was read.
+        """
+        with self._orders_condition:
+            self._orders_condition.wait_for(lambda: self._order_versions.get(order_id, 0) > version, timeout)
+            return self.orders.get(order_id, None), self._order_versions.get(order_id, 0)
+
 
 class OrderGuard:
     def __init__(self, pending_orders: Set[Tuple[str, int]], mutex: threading.Lock):
@@ -74,36 +122,81 @@ class BinanceStreamManager:
         logger: Logger,
     ):
         self.cache = cache
+        self.config = config
         self.logger = logger
-        exchange_name = f"binance.{config.BINANCE_TLD}"
-        if config.TESTNET:
+        self.binance_client = binance_client
+        self.pending_orders: Set[Tuple[str, int]] = set()
+        self.pending_orders_mutex: threading.Lock = threading.Lock()
+        self.watched_symbols: Set[str] = set()
+        self.ticker_updated = threading.Event()
+        # Filled by the websocket threads, drained by the processor thread which blocks while it's empty
+        self.events: "queue.Queue[Optional[Tuple[str, Any]]]" = queue.Queue()
+        self.handlers: Dict[str, Callable[[Dict[str, Any]], None]] = {
+            "executionReport": self._on_execution_report,  # !userData
+            "balanceUpdate": self._on_balance_update,  # !userData
+            "outboundAccountPosition": self._on_account_position,  # !userData
+            "outboundAccountInfo": self._on_account_position,  # !userData
+            "24hrMiniTicker": self._on_mini_ticker,
+        }
+        STREAM_QUEUE_DEPTH.set_function(self.events.qsize)
+        self.bw_api_manager = self._create_websocket_manager()
+        self._processorThread = threading.Thread(target=self._stream_processor, name="stream-processor")
+        self._processorThread.start()
+
+    def _create_websocket_manager(self) -> BinanceWebSocketApiManager:
+        """
+        Open the !miniTicker and !userData streams, which push their data and signals to the event queue
+        """
+        exchange_name = f"binance.{self.config.BINANCE_TLD}"
+        if self.config.TESTNET:
             exchange_name += "-testnet"
-        self.bw_api_manager = BinanceWebSocketApiManager(
+        bw_api_manager = BinanceWebSocketApiManager(
             output_default="UnicornFy",
-            enable_stream_signal_buffer=True,
             exchange=exchange_name,
+            process_stream_data=self._on_stream_data,
+            process_stream_signals=self._on_stream_signal,
         )
-        self.bw_api_manager.create_stream(
+        bw_api_manager.create_stream(
             ["arr"],
             ["!miniTicker"],
-            api_key=config.BINANCE_API_KEY,
-            api_secret=config.BINANCE_API_SECRET_KEY,
+            api_key=self.config.BINANCE_API_KEY,
+            api_secret=self.config.BINANCE_API_SECRET_KEY,
         )
-        self.bw_api_manager.create_stream(
+        bw_api_manager.create_stream(
             ["arr"],
             ["!userData"],
-            api_key=config.BINANCE_API_KEY,
-            api_secret=config.BINANCE_API_SECRET_KEY,
+            api_key=self.config.BINANCE_API_KEY,
+            api_secret=self.config.BINANCE_API_SECRET_KEY,
         )
-        self.binance_client = binance_client
-        self.pending_orders: Set[Tuple[str, int]] = set()
-        self.pending_orders_mutex: threading.Lock = threading.Lock()
-        self._processorThread = threading.Thread(target=self._stream_processor)
-        self._processorThread.start()
+        return bw_api_manager
+
+    def register_handler(self, event_type: str, handler: Callable[[Dict[str, Any]], None]):
+        """
+        Handle the stream events of `event_type` with `handler`, replacing the current handler if any
+        """
+        self.handlers[event_type] = handler
 
     def acquire_order_guard(self):
         return OrderGuard(self.pending_orders, self.pending_orders_mutex)
 
+    def watch_symbols(self, symbols: Iterable[str]):
+        """
+        Signal `ticker_updated` whenever the price of one of these symbols changes
+        """
+        self.watched_symbols = set(symbols)
+
+    def wait_for_ticker_update(self, timeout: float, debounce: float = 0.0) -> bool:
+        """
+        Wait up to `timeout` seconds for a watched price to change. Once one did, wait `debounce` more
+        seconds so that the updates arriving together are handled by a single wake-up.
+        """
+        if not self.ticker_updated.wait(timeout):
+            return False
+        if debounce > 0:
+            time.sleep(debounce)
+        self.ticker_updated.clear()
+        return True
+
     def _fetch_pending_orders(self):
         pending_orders: Set[Tuple[str, int]]
         with self.pending_orders_mutex:
@@ -132,59 +225,93 @@ class BinanceStreamManager:
                 f"Pending order {order_id} for symbol {symbol} fetched:\n{fake_report}",
                 False,
             )
-            self.cache.orders[fake_report["order_id"]] = BinanceOrder(fake_report)
+            self.cache.update_order(BinanceOrder(fake_report))
 
     def _invalidate_balances(self):
-        with self.cache.open_balances() as balances:
+        with self.cache.open_balances() as balances, self.cache.open_total_balances() as total_balances:
             balances.clear()
+            total_balances.clear()
+
+    def _on_stream_data(self, stream_data, stream_buffer_name=False):  # pylint: disable=unused-argument
+        self.events.put(("data", stream_data))
+
+    def _on_stream_signal(self, signal_type, stream_id, data_record=False):  # pylint: disable=unused-argument
+        self.events.put(("signal", (signal_type, stream_id)))
 
     def _stream_processor(self):
         while True:
-            if self.bw_api_manager.is_manager_stopping():
-                sys.exit()
-
-            stream_signal = self.bw_api_manager.pop_stream_signal_from_stream_signal_buffer()
-            stream_data = self.bw_api_manager.pop_stream_data_from_stream_buffer()
-
-            if stream_signal is not False:
-                signal_type = stream_signal["type"]
-                stream_id = stream_signal["stream_id"]
-                if signal_type == "CONNECT":
-                    stream_info = self.bw_api_manager.get_stream_info(stream_id)
-                    if "!userData" in stream_info["markets"]:
-                        self.logger.debug("Connect for userdata arrived", False)
-                        self._fetch_pending_orders()
-                        self._invalidate_balances()
-            if stream_data is not False:
-                self._process_stream_data(stream_data)
-            if stream_data is False and stream_signal is False:
-                time.sleep(0.01)
+            event = self.events.get()
+            if event is None:
+                return
+            kind, payload = event
+            try:
+                if kind == "signal":
+                    self._process_stream_signal(*payload)
+                else:
+                    self._process_stream_data(payload)
+            except Exception as e:  # pylint: disable=broad-except
+                self.logger.error(f"Failed to process stream {kind} {payload}: {e}")
+
+    def _process_stream_signal(self, signal_type, stream_id):
+        if signal_type == "CONNECT":
+            stream_info = self.bw_api_manager.get_stream_info(stream_id)
+            if "!userData" in stream_info["markets"]:
+                self.logger.debug("Connect for userdata arrived", False)
+                self._fetch_pending_orders()
+                self._invalidate_balances()
+
+    @staticmethod
+    def _record_lag(event_type: str, stream_data):
+        # The ticker arrays carry the time of each ticker, the other events their own
+        event_time = stream_data.get("event_time")
+        if event_time is None and stream_data.get("data"):
+            event_time = stream_data["data"][0].get("event_time")
+        if event_time is not None:
+            # Includes the offset between the clocks of Binance and of this machine, which can go below 0
+            STREAM_EVENT_LAG.labels(event_type).observe(max(0.0, time.time() - event_time / 1000))
 
     def _process_stream_data(self, stream_data):
-        event_type = stream_data["event_type"]
-        if event_type == "executionReport":  # !userData
-            self.logger.debug(f"execution report: {stream_data}")
-            order = BinanceOrder(stream_data)
-            self.cache.orders[order.id] = order
-        elif event_type == "balanceUpdate":  # !userData
-            self.logger.debug(f"Balance update: {stream_data}")
-            with self.cache.open_balances() as balances:
-                asset = stream_data["asset"]
-                if asset in balances:
-                    del balances[stream_data["asset"]]
-        elif event_type in (
-            "outboundAccountPosition",
-            "outboundAccountInfo",
-        ):  # !userData
-            self.logger.debug(f"{event_type}: {stream_data}")
-            with self.cache.open_balances() as balances:
-                for bal in stream_data["balances"]:
-                    balances[bal["asset"]] = float(bal["free"])
-        elif event_type == "24hrMiniTicker":
-            for event in stream_data["data"]:
-                self.cache.ticker_values[event["symbol"]] = float(event["close_price"])
-        else:
+        event_type = stream_data.get("event_type")
+        handler = self.handlers.get(event_type)
+        if handler is None:
             self.logger.error(f"Unknown event type found: {event_type}\n{stream_data}")
+            return
+        self._record_lag(event_type, stream_data)
+        handler(stream_data)
+
+    def _on_execution_report(self, stream_data):
+        self.logger.debug(f"execution report: {stream_data}")
+        self.cache.update_order(BinanceOrder(stream_data))
+
+    def _on_balance_update(self, stream_data):
+        self.logger.debug(f"Balance update: {stream_data}")
+        with self.cache.open_balances() as balances, self.cache.open_total_balances() as total_balances:
+            asset = stream_data["asset"]
+            if asset in balances:
+                del balances[stream_data["asset"]]
+            total_balances.pop(asset, None)
+
+    def _on_account_position(self, stream_data):
+        self.logger.debug(f"{stream_data['event_type']}: {stream_data}")
+        with self.cache.open_balances() as balances, self.cache.open_total_balances() as total_balances:
+            for bal in stream_data["balances"]:
+                balances[bal["asset"]] = float(bal["free"])
+                if "locked" in bal:
+                    total_balances[bal["asset"]] = float(bal["free"]) + float(bal["locked"])
+                else:
+                    total_balances.pop(bal["asset"], None)
+
+    def _on_mini_ticker(self, stream_data):
+        updated = False
+        for event in stream_data["data"]:
+            symbol = event["symbol"]
+            price = float(event["close_price"])
+            if symbol in self.watched_symbols and self.cache.ticker_values.get(symbol) != price:
+                updated = True
+            self.cache.ticker_values[symbol] = price
+        if updated:
+            self.ticker_updated.set()
 
     def close(self):
         self.bw_api_manager.stop_manager_with_all_streams()
+        self.events.put(None)
@@ -18,6 +18,7 @@ class Config:  # pylint: disable=too-few-public-methods,too-many-instance-attrib
             "scout_multiplier": "5",
             "scout_margin": "0.8",
             "scout_sleep_time": "5",
+            "scout_on_ticker": "yes",
             "hourToKeepScoutHistory": "1",
             "tld": "com",
             "strategy": "default",
@@ -69,6 +70,7 @@ class Config:  # pylint: disable=too-few-public-methods,too-many-instance-attrib
         # Get config for scout
         self.SCOUT_MULTIPLIER = float(get_val(USER_CFG_SECTION, "scout_multiplier", 5))
         self.SCOUT_SLEEP_TIME = int(get_val(USER_CFG_SECTION, "scout_sleep_time", 5))
+        self.SCOUT_ON_TICKER = get_val(USER_CFG_SECTION, "scout_on_ticker", True, is_bool=True)
 
         # Get config for binance
         self.BINANCE_API_KEY = get_val(USER_CFG_SECTION, "api_key")
@@ -10,6 +10,9 @@ from .scheduler import SafeScheduler
 from .strategies import get_strategy
 from .dashboard import start_dashboard, bot_status
 
+# Seconds to wait after a ticker update so that a burst of updates triggers a single scout
+TICKER_DEBOUNCE = 0.05
+
 
 def main():
     logger = Logger()
@@ -18,9 +21,9 @@ def main():
     config = Config()
     db = Database(logger, config)
     manager = BinanceAPIManager(config, db, logger, config.TESTNET)
-    # check if we can access API feature that require valid config
+    # check if we can access API feature that require valid config, while loading the account state
     try:
-        _ = manager.get_account()
+        manager.warm_up()
     except Exception as e:  # pylint: disable=broad-except
         logger.error("Couldn't access Binance API - API keys may be wrong or lack sufficient permissions")
         logger.error(e)
@@ -79,14 +82,25 @@ def main():
             logger.warning(f"Dashboard sync failed: {e}")
 
     schedule = SafeScheduler(logger)
-    schedule.every(config.SCOUT_SLEEP_TIME).seconds.do(trader.scout).tag("scouting")
-    schedule.every(1).minutes.do(trader.update_values).tag("updating value history")
-    schedule.every(30).seconds.do(sync_dashboard).tag("syncing dashboard")
+    # Each run of these jobs reads and writes through a single session, committed once when the job ends
+    scout_job = schedule.every(config.SCOUT_SLEEP_TIME).seconds.do(db.in_unit_of_work(trader.scout)).tag("scouting")
+    schedule.every(1).minutes.do(db.in_unit_of_work(trader.update_values)).tag("updating value history")
+    schedule.every(30).seconds.do(db.in_unit_of_work(sync_dashboard)).tag("syncing dashboard")
     schedule.every(1).minutes.do(db.prune_scout_history).tag("pruning scout history")
     schedule.every(1).hours.do(db.prune_value_history).tag("pruning value history")
+    stream_manager = manager.stream_manager
+    if config.SCOUT_ON_TICKER:
+        # Scout as soon as a price it depends on changes, the timer only kicks in when the stream is quiet
+        stream_manager.watch_symbols(coin.symbol + config.BRIDGE.symbol for coin in db.get_coins())
     try:
         while True:
+            if config.SCOUT_ON_TICKER:
+                if stream_manager.wait_for_ticker_update(timeout=1, debounce=TICKER_DEBOUNCE):
+                    schedule.run_now(scout_job)
+            else:
+                time.sleep(1)
             schedule.run_pending()
-            time.sleep(1)
     finally:
-        manager.stream_manager.close()
\ No newline at end of file
+        manager.stream_manager.close()
+        manager.close()
+        db.close()
\ No newline at end of file
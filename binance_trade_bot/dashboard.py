@@ -1,4 +1,5 @@
-from flask import Flask, render_template_string, jsonify
+from flask import Flask, Response, render_template_string, jsonify
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 import threading
 import os
 from datetime import datetime
@@ -274,6 +275,11 @@ def status():
 def ping():
     return jsonify({"status": "ok", "timestamp": datetime.now().isoformat()})
 
+@app.route("/metrics")
+def metrics():
+    # Prometheus text format: scheduler job timings, REST latency, stream event lag and order fill times
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
 def run_dashboard():
     port = int(os.environ.get("PORT", 5000))
     # Use threaded=True to ensure it doesn't block the bot's updates
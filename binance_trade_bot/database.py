@@ -1,18 +1,50 @@
+import functools
 import json
 import os
-import time
+import threading
 from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import List, Optional, Union
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
-from socketio import Client
-from socketio.exceptions import ConnectionError as SocketIOConnectionError
-from sqlalchemy import create_engine, func
+from sqlalchemy import create_engine, event, func
 from sqlalchemy.orm import Session, scoped_session, sessionmaker
 
+from . import migrations
 from .config import Config
 from .logger import Logger
 from .models import *  # pylint: disable=wildcard-import
+from .scout_history_writer import ScoutHistoryWriter
+from .update_emitter import UpdateEmitter
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):  # pylint: disable=unused-argument
+    """
+    WAL lets the api server read the database while the bot writes to it. With WAL, synchronous=NORMAL only
+    syncs on checkpoints and stays safe against corruption.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=10000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-16000")
+    cursor.close()
+
+
+def _track_writes(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument
+    if not statement.lstrip()[:6].upper().startswith(("SELECT", "PRAGMA")):
+        conn.info["writes"] = True
+
+
+def _end_transaction(session: Session):
+    """
+    Commit the session if it wrote anything, otherwise only end its read transaction
+    """
+    session.flush()
+    if session.in_transaction() and session.connection().info.pop("writes", False):
+        session.commit()
+    else:
+        session.rollback()
 
 
 class Database:
@@ -20,30 +52,101 @@ class Database:
         self.logger = logger
         self.config = config
         self.engine = create_engine(uri)
+        if self.engine.url.database not in (None, "", ":memory:"):
+            event.listen(self.engine, "connect", _set_sqlite_pragmas)
+        event.listen(self.engine, "before_cursor_execute", _track_writes)
         self.SessionMaker = sessionmaker(bind=self.engine)
-        self.socketio_client = Client()
+        # Thread-local sessions of the units of work, see unit_of_work()
+        self.Session = scoped_session(self.SessionMaker)
+        self._units = threading.local()
+
+        # In-memory copy of the coins, pairs and current coin. It is only built by set_coins(), which is
+        # called by the process that owns the trading state, and every write to it goes through to SQL.
+        # Processes that only read the database (e.g. the api server) keep querying SQL directly.
+        self._coins: Optional[Dict[str, Coin]] = None
+        self._pairs: Dict[Tuple[str, str], Pair] = {}
+        self._pairs_from: Dict[str, List[Pair]] = {}
+        self._pairs_to: Dict[str, List[Pair]] = {}
+        self._current_coin: Optional[Coin] = None
+
+        # Datetime of the last value logged for each coin, to tag new values with the interval they start
+        self._last_value_datetimes: Dict[str, Optional[datetime]] = {}
+
+        # Started on the first scout log, so that processes which never scout don't spawn a writer thread
+        self.scout_history_writer: Optional[ScoutHistoryWriter] = None
+        # Started on the first update, for the same reason
+        self.update_emitter: Optional[UpdateEmitter] = None
+        self._update_emitter_mutex = threading.Lock()
+
+    def close(self):
+        """
+        Flush the buffered writes. Must be called before the process exits.
+        """
+        if self.scout_history_writer is not None:
+            self.scout_history_writer.stop()
+        if self.update_emitter is not None:
+            self.update_emitter.stop()
 
-    def socketio_connect(self):
-        if self.socketio_client.connected and self.socketio_client.namespaces:
-            return True
+    @contextmanager
+    def db_session(self):
+        """
+        Creates a context with an open SQLAlchemy session. Inside a unit of work, that's the session of
+        the unit and it's committed when the unit ends. Otherwise the session is committed when the
+        context exits, if anything was written.
+        """
+        if getattr(self._units, "depth", 0):
+            yield self.Session()
+            return
+        session: Session = self.SessionMaker()
         try:
-            if not self.socketio_client.connected:
-                self.socketio_client.connect("http://api:5123", namespaces=["/backend"])
-            while not self.socketio_client.connected or not self.socketio_client.namespaces:
-                time.sleep(0.1)
-            return True
-        except SocketIOConnectionError:
-            return False
+            yield session
+            _end_transaction(session)
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            session.close()
 
     @contextmanager
-    def db_session(self):
+    def unit_of_work(self):
         """
-        Creates a context with an open SQLAlchemy session.
+        Run everything inside the context in a single thread-local session, committed once at the end.
+        Units can be nested, only the outermost one commits.
         """
-        session: Session = scoped_session(self.SessionMaker)
-        yield session
-        session.commit()
-        session.close()
+        depth = getattr(self._units, "depth", 0)
+        session: Session = self.Session()
+        self._units.depth = depth + 1
+        try:
+            yield session
+            if depth == 0:
+                _end_transaction(session)
+        except BaseException:
+            if depth == 0:
+                session.rollback()
+            raise
+        finally:
+            self._units.depth = depth
+            if depth == 0:
+                self.Session.remove()
+
+    def checkpoint(self):
+        """
+        Commit what the current unit of work wrote so far, e.g. so that no write lock is held while waiting
+        """
+        if getattr(self._units, "depth", 0):
+            _end_transaction(self.Session())
+
+    def in_unit_of_work(self, job: Callable) -> Callable:
+        """
+        Wrap a function, typically a scheduler job, so that each call runs in its own unit of work
+        """
+
+        @functools.wraps(job)
+        def wrapper(*args, **kwargs):
+            with self.unit_of_work():
+                return job(*args, **kwargs)
+
+        return wrapper
 
     def set_coins(self, symbols: List[str]):
         session: Session
@@ -69,14 +172,46 @@ class Database:
         # For all the combinations of coins in the database, add a pair to the database
         with self.db_session() as session:
             coins: List[Coin] = session.query(Coin).filter(Coin.enabled).all()
-            for from_coin in coins:
-                for to_coin in coins:
-                    if from_coin != to_coin:
-                        pair = session.query(Pair).filter(Pair.from_coin == from_coin, Pair.to_coin == to_coin).first()
-                        if pair is None:
-                            session.add(Pair(from_coin, to_coin))
+            existing_pairs = set(session.query(Pair.from_coin_id, Pair.to_coin_id).all())
+            session.bulk_insert_mappings(
+                Pair,
+                [
+                    {"from_coin_id": from_coin.symbol, "to_coin_id": to_coin.symbol}
+                    for from_coin in coins
+                    for to_coin in coins
+                    if from_coin != to_coin and (from_coin.symbol, to_coin.symbol) not in existing_pairs
+                ],
+            )
+
+        self._load_graph()
+
+    def _load_graph(self):
+        """
+        Load the coins, pairs and current coin from SQL into memory
+        """
+        session: Session
+        with self.db_session() as session:
+            coins: List[Coin] = session.query(Coin).all()
+            pairs: List[Pair] = session.query(Pair).all()
+            current_coin = session.query(CurrentCoin).order_by(CurrentCoin.datetime.desc()).first()
+            current_coin = current_coin.coin if current_coin is not None else None
+            session.expunge_all()
+
+        pairs_from: Dict[str, List[Pair]] = {coin.symbol: [] for coin in coins}
+        pairs_to: Dict[str, List[Pair]] = {coin.symbol: [] for coin in coins}
+        for pair in pairs:
+            pairs_from[pair.from_coin_id].append(pair)
+            pairs_to[pair.to_coin_id].append(pair)
+
+        self._pairs = {(pair.from_coin_id, pair.to_coin_id): pair for pair in pairs}
+        self._pairs_from = pairs_from
+        self._pairs_to = pairs_to
+        self._current_coin = current_coin
+        self._coins = {coin.symbol: coin for coin in coins}
 
     def get_coins(self, only_enabled=True) -> List[Coin]:
+        if self._coins is not None:
+            return [coin for coin in self._coins.values() if coin.enabled or not only_enabled]
         session: Session
         with self.db_session() as session:
             if only_enabled:
@@ -89,6 +224,8 @@ class Database:
     def get_coin(self, coin: Union[Coin, str]) -> Coin:
         if isinstance(coin, Coin):
             return coin
+        if self._coins is not None and coin in self._coins:
+            return self._coins[coin]
         session: Session
         with self.db_session() as session:
             coin = session.query(Coin).get(coin)
@@ -97,6 +234,7 @@ class Database:
 
     def set_current_coin(self, coin: Union[Coin, str]):
         coin = self.get_coin(coin)
+        new_coin = False
         session: Session
         with self.db_session() as session:
             if isinstance(coin, Coin):
@@ -105,7 +243,23 @@ class Database:
             session.add(cc)
             self.send_update(cc)
 
+            if self._coins is not None and coin.symbol not in self._coins:
+                # e.g. the bridge, which only gets a row once we hold it
+                session.flush()
+                session.expunge(coin)
+                new_coin = True
+        # The coin we hold must outlive a rollback of the unit of work, e.g. a scout that raised after a trade,
+        # and memory is only updated once it's in SQL so that the two can't drift apart
+        self.checkpoint()
+
+        if self._coins is not None:
+            if new_coin:
+                self._coins[coin.symbol] = coin
+            self._current_coin = self._coins[coin.symbol]
+
     def get_current_coin(self) -> Optional[Coin]:
+        if self._coins is not None:
+            return self._current_coin
         session: Session
         with self.db_session() as session:
             current_coin = session.query(CurrentCoin).order_by(CurrentCoin.datetime.desc()).first()
@@ -118,6 +272,8 @@ class Database:
     def get_pair(self, from_coin: Union[Coin, str], to_coin: Union[Coin, str]):
         from_coin = self.get_coin(from_coin)
         to_coin = self.get_coin(to_coin)
+        if self._coins is not None:
+            return self._pairs.get((from_coin.symbol, to_coin.symbol))
         session: Session
         with self.db_session() as session:
             pair: Pair = session.query(Pair).filter(Pair.from_coin == from_coin, Pair.to_coin == to_coin).first()
@@ -126,6 +282,9 @@ class Database:
 
     def get_pairs_from(self, from_coin: Union[Coin, str], only_enabled=True) -> List[Pair]:
         from_coin = self.get_coin(from_coin)
+        if self._coins is not None:
+            pairs = self._pairs_from.get(from_coin.symbol, [])
+            return [pair for pair in pairs if pair.enabled or not only_enabled]
         session: Session
         with self.db_session() as session:
             pairs = session.query(Pair).filter(Pair.from_coin == from_coin)
@@ -135,7 +294,23 @@ class Database:
             session.expunge_all()
             return pairs
 
+    def get_pairs_to(self, to_coin: Union[Coin, str], only_enabled=True) -> List[Pair]:
+        to_coin = self.get_coin(to_coin)
+        if self._coins is not None:
+            pairs = self._pairs_to.get(to_coin.symbol, [])
+            return [pair for pair in pairs if pair.enabled or not only_enabled]
+        session: Session
+        with self.db_session() as session:
+            pairs = session.query(Pair).filter(Pair.to_coin == to_coin)
+            if only_enabled:
+                pairs = pairs.filter(Pair.enabled.is_(True))
+            pairs = pairs.all()
+            session.expunge_all()
+            return pairs
+
     def get_pairs(self, only_enabled=True) -> List[Pair]:
+        if self._coins is not None:
+            return [pair for pair in self._pairs.values() if pair.enabled or not only_enabled]
         session: Session
         with self.db_session() as session:
             pairs = session.query(Pair)
@@ -145,6 +320,24 @@ class Database:
             session.expunge_all()
             return pairs
 
+    def update_pair_ratios(self, ratios: Dict[Pair, float]):
+        """
+        Persist new pair ratios and apply them to the in-memory pairs
+        """
+        if not ratios:
+            return
+        session: Session
+        with self.db_session() as session:
+            session.bulk_update_mappings(Pair, [{"id": pair.id, "ratio": ratio} for pair, ratio in ratios.items()])
+        # Committed right away for the same reason as the current coin
+        self.checkpoint()
+
+        for pair, ratio in ratios.items():
+            pair.ratio = ratio
+            memory_pair = self._pairs.get((pair.from_coin_id, pair.to_coin_id))
+            if memory_pair is not None:
+                memory_pair.ratio = ratio
+
     def log_scout(
         self,
         pair: Pair,
@@ -152,12 +345,9 @@ class Database:
         current_coin_price: float,
         other_coin_price: float,
     ):
-        session: Session
-        with self.db_session() as session:
-            pair = session.merge(pair)
-            sh = ScoutHistory(pair, target_ratio, current_coin_price, other_coin_price)
-            session.add(sh)
-            self.send_update(sh)
+        if self.scout_history_writer is None:
+            self.scout_history_writer = ScoutHistoryWriter(self, self.logger)
+        self.scout_history_writer.put(ScoutHistory(pair, target_ratio, current_coin_price, other_coin_price))
 
     def prune_scout_history(self):
         time_diff = datetime.now() - timedelta(hours=self.config.SCOUT_HISTORY_PRUNE_TIME)
@@ -165,67 +355,83 @@ class Database:
         with self.db_session() as session:
             session.query(ScoutHistory).filter(ScoutHistory.datetime < time_diff).delete()
 
+    def value_interval(self, coin: Union[Coin, str], value_datetime: datetime) -> Interval:
+        """
+        The interval to tag a new value of a coin with: a value logged in a week, day or hour that has no
+        value yet is the weekly, daily or hourly sample of that period. Values must be logged in order.
+        """
+        coin_id = coin if isinstance(coin, str) else coin.symbol
+        if coin_id not in self._last_value_datetimes:
+            session: Session
+            with self.db_session() as session:
+                self._last_value_datetimes[coin_id] = (
+                    session.query(func.max(CoinValue.datetime)).filter(CoinValue.coin_id == coin_id).scalar()
+                )
+        last_datetime = self._last_value_datetimes[coin_id]
+        self._last_value_datetimes[coin_id] = value_datetime
+
+        if last_datetime is None or value_datetime.strftime("%Y-%W") != last_datetime.strftime("%Y-%W"):
+            return Interval.WEEKLY
+        if value_datetime.date() != last_datetime.date():
+            return Interval.DAILY
+        if value_datetime.hour != last_datetime.hour:
+            return Interval.HOURLY
+        return Interval.MINUTELY
+
+    def _delete_values_before(self, interval: Interval, time_diff: datetime, batch_size=5000):
+        """
+        Delete the values of an interval older than `time_diff`, oldest first, in short transactions
+        """
+        while True:
+            session: Session
+            with self.db_session() as session:
+                ids = (
+                    session.query(CoinValue.id)
+                    .filter(CoinValue.interval == interval, CoinValue.datetime < time_diff)
+                    .order_by(CoinValue.datetime.asc())
+                    .limit(batch_size)
+                    .subquery()
+                )
+                deleted = (
+                    session.query(CoinValue).filter(CoinValue.id.in_(ids.select())).delete(synchronize_session=False)
+                )
+            if deleted < batch_size:
+                return
+
     def prune_value_history(self):
-        session: Session
-        with self.db_session() as session:
-            # Sets the first entry for each coin for each hour as 'hourly'
-            hourly_entries: List[CoinValue] = (
-                session.query(CoinValue).group_by(CoinValue.coin_id, func.strftime("%H", CoinValue.datetime)).all()
-            )
-            for entry in hourly_entries:
-                entry.interval = Interval.HOURLY
+        """
+        Values are tagged with their interval when they are logged, so pruning only deletes the oldest ones
+        """
+        # The last 24 hours worth of minutely entries will be kept, so
+        # count(coins) * 1440 entries
+        self._delete_values_before(Interval.MINUTELY, datetime.now() - timedelta(hours=24))
 
-            # Sets the first entry for each coin for each day as 'daily'
-            daily_entries: List[CoinValue] = (
-                session.query(CoinValue).group_by(CoinValue.coin_id, func.date(CoinValue.datetime)).all()
-            )
-            for entry in daily_entries:
-                entry.interval = Interval.DAILY
+        # The last 28 days worth of hourly entries will be kept, so count(coins) * 672 entries
+        self._delete_values_before(Interval.HOURLY, datetime.now() - timedelta(days=28))
 
-            # Sets the first entry for each coin for each month as 'weekly'
-            # (Sunday is the start of the week)
-            weekly_entries: List[CoinValue] = (
-                session.query(CoinValue).group_by(CoinValue.coin_id, func.strftime("%Y-%W", CoinValue.datetime)).all()
-            )
-            for entry in weekly_entries:
-                entry.interval = Interval.WEEKLY
-
-            # The last 24 hours worth of minutely entries will be kept, so
-            # count(coins) * 1440 entries
-            time_diff = datetime.now() - timedelta(hours=24)
-            session.query(CoinValue).filter(
-                CoinValue.interval == Interval.MINUTELY, CoinValue.datetime < time_diff
-            ).delete()
-
-            # The last 28 days worth of hourly entries will be kept, so count(coins) * 672 entries
-            time_diff = datetime.now() - timedelta(days=28)
-            session.query(CoinValue).filter(
-                CoinValue.interval == Interval.HOURLY, CoinValue.datetime < time_diff
-            ).delete()
-
-            # The last years worth of daily entries will be kept, so count(coins) * 365 entries
-            time_diff = datetime.now() - timedelta(days=365)
-            session.query(CoinValue).filter(
-                CoinValue.interval == Interval.DAILY, CoinValue.datetime < time_diff
-            ).delete()
-
-            # All weekly entries will be kept forever
+        # The last years worth of daily entries will be kept, so count(coins) * 365 entries
+        self._delete_values_before(Interval.DAILY, datetime.now() - timedelta(days=365))
+
+        # All weekly entries will be kept forever
 
     def create_database(self):
-        Base.metadata.create_all(self.engine)
+        """
+        Create the database, or migrate an existing one to the current schema
+        """
+        migrations.upgrade(self.engine, self.logger)
 
     def start_trade_log(self, from_coin: Coin, to_coin: Coin, selling: bool):
         return TradeLog(self, from_coin, to_coin, selling)
 
     def send_update(self, model):
-        if not self.socketio_connect():
-            return
-
-        self.socketio_client.emit(
-            "update",
-            {"table": model.__tablename__, "data": model.info()},
-            namespace="/backend",
-        )
+        """
+        Queue an update of the dashboard, it is sent to the api server in the background
+        """
+        if self.update_emitter is None:
+            with self._update_emitter_mutex:
+                if self.update_emitter is None:
+                    self.update_emitter = UpdateEmitter(self.logger)
+        self.update_emitter.put(model.__tablename__, model.info())
 
     def migrate_old_state(self):
         """
@@ -244,15 +450,13 @@ class Database:
             with open(".current_coin_table") as f:
                 self.logger.info(f".current_coin_table file found, loading into database")
                 table: dict = json.load(f)
-                session: Session
-                with self.db_session() as session:
-                    for from_coin, to_coin_dict in table.items():
-                        for to_coin, ratio in to_coin_dict.items():
-                            if from_coin == to_coin:
-                                continue
-                            pair = session.merge(self.get_pair(from_coin, to_coin))
-                            pair.ratio = ratio
-                            session.add(pair)
+                ratios: Dict[Pair, float] = {}
+                for from_coin, to_coin_dict in table.items():
+                    for to_coin, ratio in to_coin_dict.items():
+                        if from_coin == to_coin:
+                            continue
+                        ratios[self.get_pair(from_coin, to_coin)] = ratio
+                self.update_pair_ratios(ratios)
 
             os.rename(".current_coin_table", ".current_coin_table.old")
             self.logger.info(".current_coin_table renamed to .current_coin_table.old - " "You can now delete this file")
@@ -270,6 +474,7 @@ class TradeLog:
             # Flush so that SQLAlchemy fills in the id column
             session.flush()
             self.db.send_update(self.trade)
+        self.db.checkpoint()
 
     def set_ordered(self, alt_starting_balance, crypto_starting_balance, alt_trade_amount):
         session: Session
@@ -280,6 +485,8 @@ class TradeLog:
             trade.crypto_starting_balance = crypto_starting_balance
             trade.state = TradeState.ORDERED
             self.db.send_update(trade)
+        # Don't hold the write lock while the order is waited on
+        self.db.checkpoint()
 
     def set_complete(self, crypto_trade_amount):
         session: Session
@@ -288,6 +495,7 @@ class TradeLog:
             trade.crypto_trade_amount = crypto_trade_amount
             trade.state = TradeState.COMPLETE
             self.db.send_update(trade)
+        self.db.checkpoint()
 
 
 if __name__ == "__main__":
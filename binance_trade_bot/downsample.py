@@ -0,0 +1,41 @@
+import numpy as np
+
+
+def lttb(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling of the series (x, y), x being sorted.
+
+    The points between the first and the last one are split in `points` - 2 buckets, and from each bucket
+    the point forming the largest triangle with the point kept from the previous bucket and the average of
+    the next bucket is kept, which preserves the peaks and troughs of the series.
+
+    :return: The sorted indices of the points to keep
+    """
+    size = len(x)
+    if points >= size or points < 3:
+        return np.arange(size)
+
+    y = np.nan_to_num(y)
+    # Bucket k holds the points [edges[k], edges[k + 1])
+    edges = np.linspace(1, size - 1, points - 1).astype(np.int64)
+    counts = np.diff(edges)
+    means_x = np.add.reduceat(x[: size - 1], edges[:-1]) / counts
+    means_y = np.add.reduceat(y[: size - 1], edges[:-1]) / counts
+    # The third point of the last bucket is the last point of the series
+    means_x = np.append(means_x[1:], x[-1])
+    means_y = np.append(means_y[1:], y[-1])
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = size - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Twice the area of the triangles, which has the same maximum
+        areas = np.abs(
+            (x[previous] - means_x[bucket]) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (means_y[bucket] - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
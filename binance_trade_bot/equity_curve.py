@@ -0,0 +1,126 @@
+import math
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from .kline_store import datetime_of
+
+MINUTES_PER_YEAR = 365 * 24 * 60
+
+
+class EquityCurve:
+    """
+    Value of a portfolio in bridge and BTC terms, sampled every `period` minutes into preallocated arrays.
+
+    The peak, max drawdown and the running mean and variance of the returns (Welford's algorithm) are
+    updated with every point, so appending is O(1) and the metrics are available at any time.
+    """
+
+    def __init__(self, period: int, capacity=1024):
+        self.period = period
+        self.minutes = np.empty(capacity, dtype=np.int64)
+        self.bridge_values = np.empty(capacity, dtype=np.float64)
+        self.btc_values = np.empty(capacity, dtype=np.float64)
+        self.size = 0
+
+        self.peak = 0.0
+        self.max_drawdown = 0.0
+        self._value_sum = 0.0
+        self._returns = 0
+        self._return_mean = 0.0
+        self._return_m2 = 0.0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, minute: int, bridge_value: float, btc_value: float):
+        if self.size == len(self.minutes):
+            capacity = 2 * len(self.minutes)
+            self.minutes = np.resize(self.minutes, capacity)
+            self.bridge_values = np.resize(self.bridge_values, capacity)
+            self.btc_values = np.resize(self.btc_values, capacity)
+
+        if self.size and self.bridge_values[self.size - 1] > 0:
+            period_return = bridge_value / float(self.bridge_values[self.size - 1]) - 1
+            self._returns += 1
+            delta = period_return - self._return_mean
+            self._return_mean += delta / self._returns
+            self._return_m2 += delta * (period_return - self._return_mean)
+
+        self._value_sum += bridge_value
+        self.peak = max(self.peak, bridge_value)
+        if self.peak > 0:
+            self.max_drawdown = max(self.max_drawdown, (self.peak - bridge_value) / self.peak)
+
+        self.minutes[self.size] = minute
+        self.bridge_values[self.size] = bridge_value
+        self.btc_values[self.size] = btc_value
+        self.size += 1
+
+    def mean_value(self) -> float:
+        return self._value_sum / self.size if self.size else 0.0
+
+    def sharpe_ratio(self) -> Optional[float]:
+        """
+        Annualized Sharpe ratio of the bridge returns, with a risk-free rate of 0
+        """
+        if self._returns < 2:
+            return None
+        deviation = math.sqrt(self._return_m2 / (self._returns - 1))
+        if deviation == 0:
+            return None
+        return self._return_mean / deviation * math.sqrt(MINUTES_PER_YEAR / self.period)
+
+    def datetimes(self):
+        return [datetime_of(int(minute)) for minute in self.minutes[: self.size]]
+
+
+class BacktestResult:  # pylint: disable=too-many-instance-attributes
+    """
+    Outcome of a backtest: its equity curve, performance metrics and final balances
+    """
+
+    def __init__(
+        self,
+        equity: EquityCurve,
+        trade_count: int,
+        traded_volume: float,
+        fees_paid: float,
+        final_balances: Dict[str, float],
+    ):
+        self.equity = equity
+        self.start_date: datetime = datetime_of(int(equity.minutes[0]))
+        self.end_date: datetime = datetime_of(int(equity.minutes[equity.size - 1]))
+        self.start_value = float(equity.bridge_values[0])
+        self.final_value = float(equity.bridge_values[equity.size - 1])
+        self.return_pct = _change_pct(self.start_value, self.final_value)
+        self.btc_return_pct = _change_pct(float(equity.btc_values[0]), float(equity.btc_values[equity.size - 1]))
+        self.max_drawdown_pct = equity.max_drawdown * 100
+        self.sharpe_ratio = equity.sharpe_ratio()
+        self.trade_count = trade_count
+        # Traded volume over the average value of the portfolio, both in bridge terms
+        average_value = equity.mean_value()
+        self.turnover = traded_volume / average_value if average_value else 0.0
+        self.fees_paid = fees_paid
+        self.final_balances = final_balances
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "start_date": self.start_date.isoformat(),
+            "end_date": self.end_date.isoformat(),
+            "start_value": self.start_value,
+            "final_value": self.final_value,
+            "return_pct": self.return_pct,
+            "btc_return_pct": self.btc_return_pct,
+            "max_drawdown_pct": self.max_drawdown_pct,
+            "sharpe_ratio": self.sharpe_ratio,
+            "turnover": self.turnover,
+            "fees_paid": self.fees_paid,
+            "trade_count": self.trade_count,
+            "final_balances": self.final_balances,
+        }
+
+
+def _change_pct(start: float, end: float) -> float:
+    return (end - start) / start * 100 if start else 0.0
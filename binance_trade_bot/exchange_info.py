@@ -0,0 +1,85 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .logger import Logger
+
+
+class SymbolInfo:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    """
+    Trading rules of one symbol, parsed from its exchange info entry
+    """
+
+    def __init__(self, info: Dict[str, Any]):
+        self.symbol: str = info["symbol"]
+        self.status: str = info.get("status", "TRADING")
+        self.base_asset_precision: int = info["baseAssetPrecision"]
+        self.quote_precision: int = info["quotePrecision"]
+        self.filters: Dict[str, Dict[str, Any]] = {_filter["filterType"]: _filter for _filter in info["filters"]}
+
+        lot_size = self.filters.get("LOT_SIZE")
+        self.step_size: Optional[str] = lot_size["stepSize"] if lot_size else None
+        self.alt_tick: Optional[int] = None
+        if self.step_size is not None:
+            if self.step_size.find("1") == 0:
+                self.alt_tick = 1 - self.step_size.find(".")
+            else:
+                self.alt_tick = self.step_size.find("1") - 1
+
+        notional = self.filters.get("NOTIONAL") or self.filters.get("MIN_NOTIONAL")
+        self.min_notional: Optional[float] = float(notional["minNotional"]) if notional else None
+
+        price_filter = self.filters.get("PRICE_FILTER")
+        self.tick_size: Optional[float] = float(price_filter["tickSize"]) if price_filter else None
+
+
+class ExchangeInfo:
+    """
+    Snapshot of the exchange info of every symbol, fetched with a single request and refreshed every `ttl`
+    seconds, so that looking up the trading rules of a symbol doesn't need a request on the order path.
+    """
+
+    def __init__(self, binance_client, logger: Logger, ttl=43200):
+        self.binance_client = binance_client
+        self.logger = logger
+        self.ttl = ttl
+        self._symbols: Dict[str, SymbolInfo] = {}
+        self._expires = 0.0
+        self._mutex = threading.Lock()
+
+    def refresh(self):
+        self.load(self.binance_client.get_exchange_info())
+
+    def load(self, info: Dict[str, Any]):
+        """
+        Replace the snapshot with the response of an exchange info request
+        """
+        # Swap in a whole new index so that readers never see a partially loaded snapshot
+        self._symbols = {symbol["symbol"]: SymbolInfo(symbol) for symbol in info["symbols"]}
+        self._expires = time.monotonic() + self.ttl
+
+    def _snapshot(self) -> Dict[str, SymbolInfo]:
+        if time.monotonic() >= self._expires:
+            with self._mutex:
+                if time.monotonic() >= self._expires:
+                    try:
+                        self.refresh()
+                    except Exception as e:  # pylint: disable=broad-except
+                        if not self._symbols:
+                            raise
+                        # Keep trading on the previous snapshot, trading rules seldom change
+                        self.logger.warning(f"Couldn't refresh the exchange info: {e}", False)
+                        self._expires = time.monotonic() + 60
+        return self._symbols
+
+    def symbols(self) -> List[str]:
+        return list(self._snapshot())
+
+    def get(self, symbol: str) -> Optional[SymbolInfo]:
+        return self._snapshot().get(symbol)
+
+    def __getitem__(self, symbol: str) -> SymbolInfo:
+        info = self.get(symbol)
+        if info is None:
+            raise KeyError(f"Unknown symbol: {symbol}")
+        return info
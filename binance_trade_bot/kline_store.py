@@ -0,0 +1,261 @@
+import bisect
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from binance.exceptions import BinanceAPIException
+
+from .logger import Logger
+from .rate_limiter import RequestScheduler, ScheduledClient
+
+# Every array is indexed by the number of minutes since this date (UTC, Binance didn't exist before)
+EPOCH = datetime(2017, 7, 1)
+
+# Arrays grow by this many minutes at a time (~45 days) so that appends don't remap on every write
+GROWTH = 1 << 16
+
+INDEX_FILE = "index.json"
+
+# Binance returns at most this many klines per request
+KLINES_LIMIT = 1000
+
+
+def minute_of(date: datetime) -> int:
+    return int((date - EPOCH).total_seconds() // 60)
+
+
+def datetime_of(minute: int) -> datetime:
+    return EPOCH + timedelta(minutes=minute)
+
+
+class KlineStore:
+    """
+    Columnar store of one minute prices for backtesting.
+
+    Every symbol has its own file holding a float64 array that is memory-mapped and indexed by the minute
+    offset from EPOCH, so a price lookup is a single array index. A price of 0 means there is no price for
+    that minute. A small JSON index keeps the minute ranges that were already fetched for each symbol,
+    which tells a missing price (nothing traded, or the symbol doesn't exist) apart from a cache miss.
+    """
+
+    def __init__(self, path="data/klines", read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self._arrays: Dict[str, np.memmap] = {}
+        self._fetched: Dict[str, List[Tuple[int, int]]] = {}
+        self._mutex = threading.Lock()
+
+        if not read_only:
+            os.makedirs(path, exist_ok=True)
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, encoding="utf-8") as f:
+                index = json.load(f)
+            self._fetched = {symbol: [tuple(r) for r in ranges] for symbol, ranges in index["fetched"].items()}
+
+    def _file(self, symbol: str):
+        return os.path.join(self.path, f"{symbol}.f64")
+
+    def _open(self, symbol: str, min_length=0) -> np.ndarray:
+        array = self._arrays.get(symbol)
+        if array is not None and len(array) >= min_length:
+            return array
+
+        file = self._file(symbol)
+        length = os.path.getsize(file) // 8 if os.path.exists(file) else 0
+        if length < min_length:
+            length = (min_length // GROWTH + 1) * GROWTH
+            with open(file, "ab") as f:
+                f.truncate(length * 8)
+        if length == 0:
+            # Fetched but nothing traded, remember it so that lookups don't hit the disk again
+            self._arrays[symbol] = np.zeros(0)
+            return self._arrays[symbol]
+
+        array = np.memmap(file, dtype=np.float64, mode="r" if self.read_only else "r+", shape=(length,))
+        self._arrays[symbol] = array
+        return array
+
+    def array(self, symbol: str) -> np.ndarray:
+        """
+        The whole price array of a symbol, indexed by minute offset from EPOCH
+        """
+        return self._open(symbol)
+
+    def price(self, symbol: str, minute: int) -> Optional[float]:
+        array = self._arrays.get(symbol)
+        if array is None:
+            if symbol not in self._fetched:
+                return None
+            array = self._open(symbol)
+        if 0 <= minute < len(array):
+            price = array[minute]
+            if price > 0:
+                return float(price)
+        return None
+
+    def is_fetched(self, symbol: str, minute: int) -> bool:
+        ranges = self._fetched.get(symbol)
+        if not ranges:
+            return False
+        i = bisect.bisect_right(ranges, (minute, sys.maxsize)) - 1
+        return i >= 0 and ranges[i][0] <= minute < ranges[i][1]
+
+    def missing_ranges(self, symbol: str, start: int, end: int) -> List[Tuple[int, int]]:
+        """
+        The parts of [start, end) that haven't been fetched yet for a symbol
+        """
+        missing = []
+        for fetched_start, fetched_end in self._fetched.get(symbol, []):
+            if fetched_end <= start:
+                continue
+            if fetched_start >= end:
+                break
+            if fetched_start > start:
+                missing.append((start, fetched_start))
+            start = max(start, fetched_end)
+        if start < end:
+            missing.append((start, end))
+        return missing
+
+    def write(self, symbol: str, start: int, prices: np.ndarray):
+        """
+        Store consecutive minute prices starting at minute `start`. Missing prices must be 0.
+        """
+        with self._mutex:
+            array = self._open(symbol, start + len(prices))
+            array[start : start + len(prices)] = prices
+
+    def mark_fetched(self, symbol: str, start: int, end: int):
+        with self._mutex:
+            ranges = self._fetched.get(symbol, []) + [(start, end)]
+            ranges.sort()
+            merged = [ranges[0]]
+            for range_start, range_end in ranges[1:]:
+                if range_start <= merged[-1][1]:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], range_end))
+                else:
+                    merged.append((range_start, range_end))
+            self._fetched[symbol] = merged
+
+    def flush(self):
+        if self.read_only:
+            return
+        with self._mutex:
+            for array in self._arrays.values():
+                if isinstance(array, np.memmap):
+                    array.flush()
+            index_path = os.path.join(self.path, INDEX_FILE)
+            with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"epoch": EPOCH.isoformat(), "fetched": self._fetched}, f)
+            os.replace(index_path + ".tmp", index_path)
+
+
+def fetch_klines(store: KlineStore, client, symbol: str, start: int, end: int):
+    """
+    Fetch the one minute prices of a symbol for the minutes [start, end) into the store with a single
+    request, so end - start must not be over KLINES_LIMIT. `client` only needs a python-binance style
+    `get_klines` method.
+    """
+    start_ms = int((datetime_of(start) - datetime(1970, 1, 1)).total_seconds() * 1000)
+    prices = np.zeros(end - start)
+    try:
+        for kline in client.get_klines(
+            symbol=symbol,
+            interval="1m",
+            startTime=start_ms,
+            endTime=start_ms + (end - start) * 60000 - 1,
+            limit=KLINES_LIMIT,
+        ):
+            minute = start + (kline[0] - start_ms) // 60000
+            if start <= minute < end:
+                prices[minute - start] = float(kline[1])
+    except BinanceAPIException as e:
+        if e.code != -1121:  # Invalid symbol
+            raise
+    store.write(symbol, start, prices)
+    store.mark_fetched(symbol, start, end)
+
+
+def prefetch_klines(
+    store: KlineStore,
+    client,
+    symbols: Iterable[str],
+    start_date: datetime,
+    end_date: datetime,
+    logger: Logger = None,
+    max_workers=8,
+    weight_per_minute=1200,
+):
+    """
+    Download every missing one minute price of `symbols` between two dates, concurrently over a bounded
+    thread pool. Requests are throttled to `weight_per_minute` request weight.
+    """
+    start = minute_of(start_date)
+    end = min(minute_of(end_date), minute_of(datetime.utcnow()))
+    windows = [
+        (symbol, window_start, min(window_start + KLINES_LIMIT, missing_end))
+        for symbol in symbols
+        for missing_start, missing_end in store.missing_ranges(symbol, start, end)
+        for window_start in range(missing_start, missing_end, KLINES_LIMIT)
+    ]
+    if not windows:
+        return
+    if logger is not None:
+        logger.info(f"Prefetching {len(windows)} windows of prices between {start_date} and {end_date}")
+
+    if not isinstance(client, ScheduledClient):
+        client = ScheduledClient(client, RequestScheduler(weight_per_minute))
+
+    def fetch(window):
+        fetch_klines(store, client, *window)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for _ in executor.map(fetch, windows):
+                pass
+    finally:
+        store.flush()
+
+
+def convert_sqlitedict_cache(  # pylint: disable=too-many-locals
+    source="data/backtest_cache.db", store: KlineStore = None, logger: Logger = None
+):
+    """
+    One-time conversion of the old SqliteDict backtest cache, whose keys look like
+    "BTCUSDT - 01 Jan 2021 00:00:00", into a KlineStore
+    """
+    from sqlitedict import SqliteDict  # pylint: disable=import-outside-toplevel
+
+    store = store or KlineStore()
+    symbol_prices: Dict[str, Dict[int, float]] = {}
+    with SqliteDict(source, flag="r") as cache:
+        for key, price in cache.iteritems():
+            symbol, date = key.split(" - ", 1)
+            minute = minute_of(datetime.strptime(date, "%d %b %Y %H:%M:%S"))
+            symbol_prices.setdefault(symbol, {})[minute] = price
+
+    for symbol, prices in symbol_prices.items():
+        minutes = np.array(sorted(prices), dtype=np.int64)
+        values = np.array([prices[minute] for minute in minutes], dtype=np.float64)
+        # Each run of consecutive minutes was fetched at once
+        run_starts = np.concatenate(([0], np.nonzero(np.diff(minutes) != 1)[0] + 1))
+        run_ends = np.concatenate((run_starts[1:], [len(minutes)]))
+        for run_start, run_end in zip(run_starts, run_ends):
+            start = int(minutes[run_start])
+            store.write(symbol, start, values[run_start:run_end])
+            store.mark_fetched(symbol, start, int(minutes[run_end - 1]) + 1)
+        if logger is not None:
+            logger.info(f"Converted {len(minutes)} prices for {symbol}")
+
+    store.flush()
+    return store
+
+
+if __name__ == "__main__":
+    convert_sqlitedict_cache(*sys.argv[1:2], logger=Logger("kline_store", enable_notifications=False))
@@ -0,0 +1,55 @@
+from typing import List
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection, Engine
+
+from .logger import Logger
+from .models import Base
+
+# Every migration upgrades the schema by one version, MIGRATIONS[i] going from version i to version i + 1.
+# The version of a database file is kept in SQLite's user_version pragma. Migrations are plain SQL so that
+# they keep describing the schema as it was at their version, whatever the models look like later on.
+MIGRATIONS: List[List[str]] = [
+    # 1: indexes for the history queries of the bot, the pruning jobs and the api server
+    [
+        "CREATE INDEX IF NOT EXISTS ix_scout_history_pair_id_datetime ON scout_history (pair_id, datetime)",
+        "CREATE INDEX IF NOT EXISTS ix_scout_history_datetime ON scout_history (datetime)",
+        "CREATE INDEX IF NOT EXISTS ix_coin_value_coin_id_datetime ON coin_value (coin_id, datetime)",
+        "CREATE INDEX IF NOT EXISTS ix_coin_value_interval_datetime ON coin_value (interval, datetime)",
+        "CREATE INDEX IF NOT EXISTS ix_coin_value_datetime ON coin_value (datetime)",
+        "CREATE INDEX IF NOT EXISTS ix_trade_history_datetime ON trade_history (datetime)",
+        "CREATE INDEX IF NOT EXISTS ix_current_coin_history_datetime ON current_coin_history (datetime)",
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(connection: Connection) -> int:
+    return connection.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def _set_schema_version(connection: Connection, version: int):
+    connection.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+
+def upgrade(engine: Engine, logger: Logger):
+    """
+    Create the tables of a new database, or bring an existing one up to the current schema version
+    """
+    is_new = not inspect(engine).get_table_names()
+    Base.metadata.create_all(engine)
+
+    with engine.begin() as connection:
+        if is_new:
+            # create_all already built the latest schema
+            _set_schema_version(connection, SCHEMA_VERSION)
+            return
+        version = get_schema_version(connection)
+
+    for target_version in range(version + 1, SCHEMA_VERSION + 1):
+        logger.info(f"Migrating the database to schema version {target_version}")
+        with engine.begin() as connection:
+            for statement in MIGRATIONS[target_version - 1]:
+                connection.exec_driver_sql(statement)
+            _set_schema_version(connection, target_version)
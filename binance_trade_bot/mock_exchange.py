@@ -0,0 +1,592 @@
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+from unicorn_fy import UnicornFy
+
+from .async_client import AsyncBinanceClient
+from .binance_api_manager import BinanceAPIManager
+from .binance_stream_manager import BinanceStreamManager
+from .config import Config
+from .database import Database
+from .logger import Logger
+from .rate_limiter import USED_WEIGHT_HEADER, request_weight
+
+# Client method of every REST endpoint served, for its request weight
+ENDPOINTS = {
+    ("GET", "/api/v3/ping"): "ping",
+    ("GET", "/api/v3/time"): "get_server_time",
+    ("GET", "/api/v3/exchangeInfo"): "get_exchange_info",
+    ("GET", "/api/v3/ticker/price"): "get_symbol_ticker",
+    ("GET", "/api/v3/account"): "get_account",
+    ("POST", "/api/v3/order"): "create_order",
+    ("GET", "/api/v3/order"): "get_order",
+    ("DELETE", "/api/v3/order"): "cancel_order",
+    ("GET", "/api/v3/openOrders"): "get_open_orders",
+    ("GET", "/sapi/v1/asset/tradeFee"): "get_trade_fee",
+    ("GET", "/sapi/v1/bnbBurn"): "get_bnb_burn_spot_margin",
+}
+
+# Trading rules of every symbol, quantities have 5 decimals
+STEP_SIZE = "0.00001000"
+TICK_SIZE = "0.00000001"
+MIN_NOTIONAL = "1.00000000"
+
+
+class MockExchangeError(Exception):
+    """
+    Error answered like Binance does, with its error code and message
+    """
+
+    def __init__(self, code: int, msg: str, status=400):
+        super().__init__(msg)
+        self.code = code
+        self.msg = msg
+        self.status = status
+
+
+class MockOrder:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    def __init__(  # pylint: disable=too-many-arguments
+        self, order_id: int, symbol: str, side: str, order_type: str, quantity: float, price: float, locked: float
+    ):
+        self.id = order_id
+        self.symbol = symbol
+        self.side = side
+        self.order_type = order_type
+        self.quantity = quantity
+        self.price = price
+        # Part of the balance still held by the order, in the quote asset for a buy and the base asset for a sell
+        self.locked = locked
+        self.executed = 0.0
+        self.quote_executed = 0.0
+        self.status = "NEW"
+        self.time = int(time.time() * 1000)
+        self.update_time = self.time
+
+    def is_open(self):
+        return self.status in ("NEW", "PARTIALLY_FILLED")
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "symbol": self.symbol,
+            "orderId": self.id,
+            "orderListId": -1,
+            "clientOrderId": f"mock{self.id}",
+            "price": f"{self.price:.8f}",
+            "origQty": f"{self.quantity:.8f}",
+            "executedQty": f"{self.executed:.8f}",
+            "cummulativeQuoteQty": f"{self.quote_executed:.8f}",
+            "status": self.status,
+            "timeInForce": "GTC",
+            "type": self.order_type,
+            "side": self.side,
+            "time": self.time,
+            "updateTime": self.update_time,
+            "isWorking": True,
+        }
+
+
+class MockExchange:  # pylint: disable=too-many-instance-attributes
+    """
+    Local stand-in of Binance to run the live trading code offline, e.g. for soak and latency tests.
+
+    The REST endpoints the bot calls are served over HTTP on the loopback interface, and the !miniTicker and
+    !userData events are pushed in Binance's wire format to the subscribed MockWebSocketManagers. Every coin
+    of `prices` trades against `bridge`, at a price following a random walk ticked every `ticker_interval`
+    seconds. Orders are acknowledged at once: market orders fill right away at the current price, limit
+    orders fill at their price in `fill_parts` executions spaced `fill_latency` seconds apart. Every
+    execution moves the balances, minus a `fee` taken from the received asset.
+
+    Requests are weighed like Binance does, and answered with 429 once `weight_limit` is used up within a
+    minute.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        prices: Dict[str, float],
+        balances: Dict[str, float],
+        bridge="USDT",
+        fill_latency=0.05,
+        fill_parts=1,
+        fee=0.001,
+        ticker_interval=1.0,
+        volatility=0.001,
+        weight_limit=6000,
+        seed: int = None,
+    ):
+        self.bridge = bridge
+        self.symbols: Dict[str, Tuple[str, str]] = {coin + bridge: (coin, bridge) for coin in prices if coin != bridge}
+        self.prices: Dict[str, float] = {coin + bridge: price for coin, price in prices.items() if coin != bridge}
+        self.free: Dict[str, float] = Counter(balances)
+        self.locked: Dict[str, float] = Counter()
+        self.orders: Dict[int, MockOrder] = {}
+        self.fill_latency = fill_latency
+        self.fill_parts = max(1, fill_parts)
+        self.fee = fee
+        self.ticker_interval = ticker_interval
+        self.volatility = volatility
+        self.weight_limit = weight_limit
+        self.stats: Counter = Counter()
+
+        self._random = random.Random(seed)
+        self._order_ids = itertools.count(1)
+        self._subscribers: Dict[str, List[Callable[[str], None]]] = {}
+        self._weight_minute = 0
+        self._used_weight = 0
+        self._mutex = threading.Lock()
+
+        self._timers: List[Tuple[float, int, Callable[[], None]]] = []
+        self._timer_sequence = itertools.count()
+        self._timers_condition = threading.Condition()
+        self._stopping = False
+        self._timer_thread = threading.Thread(target=self._run_timers, name="mock-exchange-timers", daemon=True)
+
+        self.port: Optional[int] = None
+        self._loop = asyncio.new_event_loop()
+        self._runner: Optional[web.AppRunner] = None
+        self._started = threading.Event()
+        self._server_thread = threading.Thread(target=self._run_server, name="mock-exchange-server", daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        self._server_thread.start()
+        self._started.wait()
+        self._timer_thread.start()
+        if self.ticker_interval:
+            self._schedule(self.ticker_interval, self._tick)
+        return self
+
+    def close(self):
+        with self._timers_condition:
+            self._stopping = True
+            self._timers_condition.notify()
+        if self._timer_thread.is_alive():
+            self._timer_thread.join()
+        if self._server_thread.is_alive():
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._server_thread.join()
+            self._loop.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def subscribe(self, market: str, callback: Callable[[str], None]):
+        """
+        Call `callback` with the JSON of every event of a stream, "!miniTicker" or "!userData"
+        """
+        with self._mutex:
+            self._subscribers.setdefault(market, []).append(callback)
+
+    def unsubscribe(self, market: str, callback: Callable[[str], None]):
+        with self._mutex:
+            self._subscribers[market].remove(callback)
+
+    def _emit(self, market: str, event: Dict[str, Any]):
+        # Called with the mutex held, so that the events of an order are pushed in order
+        payload = json.dumps(event)
+        for callback in self._subscribers.get(market, []):
+            callback(payload)
+        self.stats[f"{market} events"] += 1
+
+    # Timers
+
+    def _schedule(self, delay: float, callback: Callable[[], None]):
+        with self._timers_condition:
+            heapq.heappush(self._timers, (time.monotonic() + delay, next(self._timer_sequence), callback))
+            self._timers_condition.notify()
+
+    def _run_timers(self):
+        while True:
+            with self._timers_condition:
+                while not self._stopping and (not self._timers or self._timers[0][0] > time.monotonic()):
+                    self._timers_condition.wait(self._timers[0][0] - time.monotonic() if self._timers else None)
+                if self._stopping:
+                    return
+                _, _, callback = heapq.heappop(self._timers)
+            callback()
+
+    def _tick(self):
+        now = int(time.time() * 1000)
+        with self._mutex:
+            events = []
+            for symbol, price in self.prices.items():
+                price *= math.exp(self._random.gauss(0, self.volatility))
+                self.prices[symbol] = price
+                events.append(
+                    {
+                        "e": "24hrMiniTicker",
+                        "E": now,
+                        "s": symbol,
+                        "c": f"{price:.8f}",
+                        "o": f"{price:.8f}",
+                        "h": f"{price:.8f}",
+                        "l": f"{price:.8f}",
+                        "v": "0",
+                        "q": "0",
+                    }
+                )
+            self._emit("!miniTicker", {"stream": "!miniTicker@arr", "data": events})
+        self._schedule(self.ticker_interval, self._tick)
+
+    # Account and orders
+
+    def _symbol(self, symbol: str) -> Tuple[str, str]:
+        assets = self.symbols.get(symbol)
+        if assets is None:
+            raise MockExchangeError(-1121, "Invalid symbol.")
+        return assets
+
+    def _order(self, symbol: str, order_id) -> MockOrder:
+        order = self.orders.get(int(order_id))
+        if order is None or order.symbol != symbol:
+            raise MockExchangeError(-2013, "Order does not exist.")
+        return order
+
+    def _balance(self, asset: str) -> Dict[str, str]:
+        return {"asset": asset, "free": f"{self.free[asset]:.8f}", "locked": f"{self.locked[asset]:.8f}"}
+
+    def _emit_account(self, *assets: str):
+        now = int(time.time() * 1000)
+        self._emit(
+            "!userData",
+            {
+                "e": "outboundAccountPosition",
+                "E": now,
+                "u": now,
+                "B": [
+                    {"a": asset, "f": f"{self.free[asset]:.8f}", "l": f"{self.locked[asset]:.8f}"} for asset in assets
+                ],
+            },
+        )
+
+    def _emit_report(self, order: MockOrder, execution: str, quantity=0.0, commission=0.0, commission_asset=None):
+        self._emit(
+            "!userData",
+            {
+                "e": "executionReport",
+                "E": order.update_time,
+                "s": order.symbol,
+                "c": f"mock{order.id}",
+                "S": order.side,
+                "o": order.order_type,
+                "f": "GTC",
+                "q": f"{order.quantity:.8f}",
+                "p": f"{order.price:.8f}",
+                "P": "0.00000000",
+                "F": "0.00000000",
+                "g": -1,
+                "C": "",
+                "x": execution,
+                "X": order.status,
+                "r": "NONE",
+                "i": order.id,
+                "l": f"{quantity:.8f}",
+                "z": f"{order.executed:.8f}",
+                "L": f"{order.price:.8f}",
+                "n": f"{commission:.8f}",
+                "N": commission_asset,
+                "T": order.update_time,
+                "t": -1,
+                "I": 0,
+                "w": order.is_open(),
+                "m": False,
+                "M": False,
+                "O": order.time,
+                "Z": f"{order.quote_executed:.8f}",
+                "Y": f"{quantity * order.price:.8f}",
+                "Q": "0.00000000",
+            },
+        )
+
+    def account(self) -> Dict[str, Any]:
+        with self._mutex:
+            return {
+                "makerCommission": 10,
+                "takerCommission": 10,
+                "canTrade": True,
+                "canWithdraw": True,
+                "canDeposit": True,
+                "updateTime": int(time.time() * 1000),
+                "accountType": "SPOT",
+                "balances": [self._balance(asset) for asset in sorted(set(self.free) | set(self.locked))],
+            }
+
+    def place_order(  # pylint: disable=too-many-arguments
+        self, symbol: str, side: str, order_type: str, quantity: float, price: float = None
+    ) -> Dict[str, Any]:
+        with self._mutex:
+            base, quote = self._symbol(symbol)
+            if side not in ("BUY", "SELL") or order_type not in ("LIMIT", "MARKET"):
+                raise MockExchangeError(-1116, "Invalid orderType.")
+            if order_type == "MARKET" or price is None:
+                price = self.prices[symbol]
+            if quantity <= 0 or quantity * price < float(MIN_NOTIONAL):
+                raise MockExchangeError(-1013, "Filter failure: NOTIONAL")
+
+            asset, amount = (quote, quantity * price) if side == "BUY" else (base, quantity)
+            if self.free[asset] < amount:
+                raise MockExchangeError(-2010, "Account has insufficient balance for requested action.")
+            self.free[asset] -= amount
+            self.locked[asset] += amount
+
+            order = MockOrder(next(self._order_ids), symbol, side, order_type, quantity, price, amount)
+            self.orders[order.id] = order
+            self.stats["orders"] += 1
+            self._emit_report(order, "NEW")
+            self._emit_account(asset)
+
+            if order_type == "MARKET":
+                self._fill(order, quantity)
+            else:
+                part = quantity / self.fill_parts
+                for i in range(self.fill_parts):
+                    self._schedule(
+                        self.fill_latency * (i + 1),
+                        lambda order=order, part=part: self._fill_later(order, part),
+                    )
+            return order.info()
+
+    def _fill_later(self, order: MockOrder, quantity: float):
+        with self._mutex:
+            if order.is_open():
+                self._fill(order, quantity)
+
+    def _fill(self, order: MockOrder, quantity: float):
+        base, quote = self.symbols[order.symbol]
+        quantity = min(quantity, order.quantity - order.executed)
+        last = order.executed + quantity >= order.quantity * (1 - 1e-9)
+        quote_quantity = quantity * order.price
+        order.executed += quantity
+        order.quote_executed += quote_quantity
+        order.status = "FILLED" if last else "PARTIALLY_FILLED"
+        order.update_time = int(time.time() * 1000)
+
+        if order.side == "BUY":
+            spent_asset, spent, received_asset, received = quote, quote_quantity, base, quantity
+        else:
+            spent_asset, spent, received_asset, received = base, quantity, quote, quote_quantity
+        # The last execution releases whatever the order still holds
+        spent = order.locked if last else min(spent, order.locked)
+        order.locked -= spent
+        self.locked[spent_asset] -= spent
+        commission = received * self.fee
+        self.free[received_asset] += received - commission
+        self.stats["fills"] += 1
+
+        self._emit_report(order, "TRADE", quantity, commission, received_asset)
+        self._emit_account(spent_asset, received_asset)
+
+    def cancel_order(self, symbol: str, order_id) -> Dict[str, Any]:
+        with self._mutex:
+            base, quote = self._symbol(symbol)
+            order = self._order(symbol, order_id)
+            if not order.is_open():
+                raise MockExchangeError(-2011, "Unknown order sent.")
+            asset = quote if order.side == "BUY" else base
+            self.locked[asset] -= order.locked
+            self.free[asset] += order.locked
+            order.locked = 0.0
+            order.status = "CANCELED"
+            order.update_time = int(time.time() * 1000)
+            self._emit_report(order, "CANCELED")
+            self._emit_account(asset)
+            return order.info()
+
+    def get_order(self, symbol: str, order_id) -> Dict[str, Any]:
+        with self._mutex:
+            return self._order(symbol, order_id).info()
+
+    def exchange_info(self) -> Dict[str, Any]:
+        return {
+            "timezone": "UTC",
+            "serverTime": int(time.time() * 1000),
+            "rateLimits": [
+                {"rateLimitType": "REQUEST_WEIGHT", "interval": "MINUTE", "intervalNum": 1, "limit": self.weight_limit}
+            ],
+            "symbols": [
+                {
+                    "symbol": symbol,
+                    "status": "TRADING",
+                    "baseAsset": base,
+                    "baseAssetPrecision": 8,
+                    "quoteAsset": quote,
+                    "quotePrecision": 8,
+                    "orderTypes": ["LIMIT", "MARKET"],
+                    "filters": [
+                        {"filterType": "PRICE_FILTER", "minPrice": TICK_SIZE, "maxPrice": "0", "tickSize": TICK_SIZE},
+                        {"filterType": "LOT_SIZE", "minQty": STEP_SIZE, "maxQty": "9000000", "stepSize": STEP_SIZE},
+                        {"filterType": "NOTIONAL", "minNotional": MIN_NOTIONAL},
+                    ],
+                }
+                for symbol, (base, quote) in self.symbols.items()
+            ],
+        }
+
+    # REST API
+
+    def _answer(self, method: str, path: str, params: Dict[str, str]):
+        if path == "/api/v3/ping":
+            return {}
+        if path == "/api/v3/time":
+            return {"serverTime": int(time.time() * 1000)}
+        if path == "/api/v3/exchangeInfo":
+            return self.exchange_info()
+        if path == "/api/v3/ticker/price":
+            with self._mutex:
+                if "symbol" in params:
+                    self._symbol(params["symbol"])
+                    return {"symbol": params["symbol"], "price": f"{self.prices[params['symbol']]:.8f}"}
+                return [{"symbol": symbol, "price": f"{price:.8f}"} for symbol, price in self.prices.items()]
+        if path == "/api/v3/account":
+            return self.account()
+        if path == "/api/v3/order":
+            if method == "POST":
+                price = params.get("price")
+                return self.place_order(
+                    params["symbol"],
+                    params["side"],
+                    params["type"],
+                    float(params["quantity"]),
+                    float(price) if price is not None else None,
+                )
+            if method == "DELETE":
+                return self.cancel_order(params["symbol"], params["orderId"])
+            return self.get_order(params["symbol"], params["orderId"])
+        if path == "/api/v3/openOrders":
+            with self._mutex:
+                return [
+                    order.info()
+                    for order in self.orders.values()
+                    if order.is_open() and params.get("symbol", order.symbol) == order.symbol
+                ]
+        if path == "/sapi/v1/asset/tradeFee":
+            return [
+                {"symbol": symbol, "makerCommission": str(self.fee), "takerCommission": str(self.fee)}
+                for symbol in self.symbols
+            ]
+        # /sapi/v1/bnbBurn
+        return {"spotBNBBurn": False, "interestBNBBurn": False}
+
+    def _use_weight(self, weight: int) -> int:
+        with self._mutex:
+            minute = int(time.time() // 60)
+            if minute != self._weight_minute:
+                self._weight_minute = minute
+                self._used_weight = 0
+            self._used_weight += weight
+            return self._used_weight
+
+    async def _handle(self, request: web.Request):
+        method = ENDPOINTS[(request.method, request.path)]
+        weight = request_weight(method)
+        used_weight = self._use_weight(weight)
+        headers = {USED_WEIGHT_HEADER: str(used_weight)}
+        self.stats["requests"] += 1
+        self.stats["request weight"] += weight
+        if used_weight > self.weight_limit:
+            headers["Retry-After"] = str(60 - int(time.time()) % 60)
+            return web.json_response({"code": -1003, "msg": "Too many requests."}, status=429, headers=headers)
+
+        params = dict(request.query)
+        params.update(await request.post())
+        try:
+            return web.json_response(self._answer(request.method, request.path, params), headers=headers)
+        except MockExchangeError as e:
+            return web.json_response({"code": e.code, "msg": e.msg}, status=e.status, headers=headers)
+        except KeyError as e:
+            return web.json_response(
+                {"code": -1102, "msg": f"Mandatory parameter {e} was not sent."}, status=400, headers=headers
+            )
+
+    def _run_server(self):
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        for method, path in ENDPOINTS:
+            app.router.add_route(method, path, self._handle)
+        self._runner = web.AppRunner(app)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        self._loop.run_until_complete(site.start())
+        self.port = self._runner.addresses[0][1]
+        self._started.set()
+        self._loop.run_forever()
+
+
+class MockWebSocketManager:
+    """
+    Stands in for the unicorn websocket manager: the streams subscribe to a MockExchange, whose events are
+    converted by UnicornFy like the real manager's
+    """
+
+    def __init__(self, exchange: MockExchange, process_stream_data, process_stream_signals):
+        self.exchange = exchange
+        self.process_stream_data = process_stream_data
+        self.process_stream_signals = process_stream_signals
+        self._streams: Dict[str, List[str]] = {}
+        self._stream_ids = itertools.count(1)
+
+    def _receive(self, payload: str):
+        self.process_stream_data(UnicornFy.binance_com_websocket(payload))
+
+    def create_stream(self, channels, markets, **kwargs):  # pylint: disable=unused-argument
+        stream_id = f"mock-stream-{next(self._stream_ids)}"
+        self._streams[stream_id] = list(markets)
+        for market in markets:
+            self.exchange.subscribe(market, self._receive)
+        self.process_stream_signals("CONNECT", stream_id)
+        return stream_id
+
+    def get_stream_info(self, stream_id):
+        return {"markets": self._streams[stream_id]}
+
+    def stop_manager_with_all_streams(self):
+        for markets in self._streams.values():
+            for market in markets:
+                self.exchange.unsubscribe(market, self._receive)
+        self._streams.clear()
+
+
+class MockExchangeStreamManager(BinanceStreamManager):
+    def __init__(self, exchange: MockExchange, *args, **kwargs):
+        self.exchange = exchange
+        super().__init__(*args, **kwargs)
+
+    def _create_websocket_manager(self):
+        bw_api_manager = MockWebSocketManager(self.exchange, self._on_stream_data, self._on_stream_signal)
+        bw_api_manager.create_stream(["arr"], ["!miniTicker"])
+        bw_api_manager.create_stream(["arr"], ["!userData"])
+        return bw_api_manager
+
+
+class MockExchangeAPIManager(BinanceAPIManager):
+    """
+    The live BinanceAPIManager, with its REST requests and streams served by a MockExchange
+    """
+
+    def __init__(self, config: Config, db: Database, logger: Logger, exchange: MockExchange):
+        self.exchange = exchange
+        super().__init__(config, db, logger, binance_client=AsyncBinanceClient("mock", "mock", api_url=exchange.url))
+
+    def setup_websockets(self):
+        self.stream_manager = MockExchangeStreamManager(
+            self.exchange, self.cache, self.config, self.binance_client, self.logger
+        )
+
+    def close(self):
+        self.stream_manager.close()
+        super().close()
@@ -1,7 +1,7 @@
 import enum
 from datetime import datetime as _datetime
 
-from sqlalchemy import Column, DateTime, Enum, Float, ForeignKey, Integer, String
+from sqlalchemy import Column, DateTime, Enum, Float, ForeignKey, Index, Integer, String
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 
@@ -18,6 +18,11 @@ class Interval(enum.Enum):
 
 class CoinValue(Base):
     __tablename__ = "coin_value"
+    __table_args__ = (
+        Index("ix_coin_value_coin_id_datetime", "coin_id", "datetime"),
+        Index("ix_coin_value_interval_datetime", "interval", "datetime"),
+        Index("ix_coin_value_datetime", "datetime"),
+    )
 
     id = Column(Integer, primary_key=True)
 
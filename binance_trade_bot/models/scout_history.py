@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, String
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, String
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship
 
@@ -10,6 +10,10 @@ from .pair import Pair
 
 class ScoutHistory(Base):
     __tablename__ = "scout_history"
+    __table_args__ = (
+        Index("ix_scout_history_pair_id_datetime", "pair_id", "datetime"),
+        Index("ix_scout_history_datetime", "datetime"),
+    )
 
     id = Column(Integer, primary_key=True)
 
@@ -1,7 +1,7 @@
 import enum
 from datetime import datetime
 
-from sqlalchemy import Boolean, Column, DateTime, Enum, Float, ForeignKey, Integer, String
+from sqlalchemy import Boolean, Column, DateTime, Enum, Float, ForeignKey, Index, Integer, String
 from sqlalchemy.orm import relationship
 
 from .base import Base
@@ -16,6 +16,7 @@ class TradeState(enum.Enum):
 
 class Trade(Base):  # pylint: disable=too-few-public-methods
     __tablename__ = "trade_history"
+    __table_args__ = (Index("ix_trade_history_datetime", "datetime"),)
 
     id = Column(Integer, primary_key=True)
 
@@ -0,0 +1,208 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from binance.exceptions import BinanceAPIException
+from prometheus_client import Counter, Histogram
+
+# Binance's default request weight limit per IP and minute is higher, some headroom is kept for the
+# other processes sharing the IP (e.g. a backtest prefetching prices)
+DEFAULT_WEIGHT_PER_MINUTE = 1200
+
+# Requests are served by priority first, then in arrival order
+PRIORITY_ORDER = 0
+PRIORITY_READ = 1
+
+# Request weight of the client methods used by the bot, the others weigh 1
+REQUEST_WEIGHTS = {
+    "get_account": 20,
+    "get_exchange_info": 20,
+    "get_symbol_ticker": 4,
+    "get_order": 4,
+    "get_open_orders": 6,
+    "get_klines": 2,
+}
+
+# Methods on the order path, served before the informational reads
+ORDER_METHODS = {
+    "create_order",
+    "order_limit",
+    "order_limit_buy",
+    "order_limit_sell",
+    "order_market",
+    "order_market_buy",
+    "order_market_sell",
+    "cancel_order",
+    "get_order",
+}
+
+USED_WEIGHT_HEADER = "x-mbx-used-weight-1m"
+
+REQUEST_DURATION = Histogram(
+    "binance_request_duration_seconds", "Latency of the REST requests, by client method", ["method"]
+)
+REQUEST_WAIT = Histogram(
+    "binance_request_wait_seconds",
+    "Time a REST request waited for its turn in the scheduler",
+    ["method"],
+    buckets=(0.001, 0.01, 0.1, 0.5, 1, 5, 10, 30, 60),
+)
+REQUEST_ERRORS = Counter(
+    "binance_request_errors_total",
+    "REST requests answered with an error, by client method and HTTP status",
+    ["method", "status"],
+)
+
+
+def request_weight(method: str) -> int:
+    return REQUEST_WEIGHTS.get(method, 1)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket holding up to `capacity` tokens, refilled continuously at `capacity` tokens
+    per `period` seconds. Used to stay under Binance's request weight limits.
+    """
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._mutex = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens: float = 1.0):
+        """
+        Take `tokens` from the bucket, waiting until enough of them are available
+        """
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """
+        Take `tokens` from the bucket if they're available and return 0, otherwise return the seconds until
+        they will be
+        """
+        with self._mutex:
+            self._refill()
+            if self.tokens >= min(tokens, self.capacity):
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def limit_used(self, used: float):
+        """
+        Account for `used` tokens spent over the last period, as counted by the server
+        """
+        with self._mutex:
+            self._refill()
+            self.tokens = min(self.tokens, self.capacity - used)
+
+
+class RequestScheduler:
+    """
+    Central gate of the REST requests of a process.
+
+    A request waits until the token bucket holds its weight and no request of a higher priority is waiting,
+    so orders and cancels get ahead of informational reads when the weight budget runs low. The bucket is
+    kept in line with the weight Binance reports in the responses, and everything stops for the time
+    Binance asks when it answers with 429 (too many requests) or 418 (IP banned).
+    """
+
+    def __init__(self, weight_per_minute=DEFAULT_WEIGHT_PER_MINUTE):
+        self.bucket = TokenBucket(weight_per_minute)
+        self._waiting: List[Tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, weight: float, priority=PRIORITY_READ):
+        """
+        Wait for the turn of a request of the given weight
+        """
+        with self._condition:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    wait: Optional[float] = None
+                    if self._waiting[0] == ticket:
+                        wait = self._paused_until - time.monotonic()
+                        if wait <= 0:
+                            wait = self.bucket.try_acquire(weight)
+                            if wait == 0:
+                                return
+                    self._condition.wait(wait)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+
+    def pause(self, seconds: float):
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def update_used_weight(self, response):
+        """
+        Read the weight used over the last minute from the headers of a response
+        """
+        if response is None:
+            return
+        used = response.headers.get(USED_WEIGHT_HEADER)
+        if used is not None:
+            self.bucket.limit_used(float(used))
+
+    def handle_exception(self, e: BinanceAPIException):
+        if e.status_code in (418, 429):
+            retry_after = e.response.headers.get("Retry-After") if e.response is not None else None
+            self.pause(float(retry_after) if retry_after else 60.0)
+
+
+class ScheduledClient:
+    """
+    Proxy of a Binance client whose requests all go through a RequestScheduler, weighted by REQUEST_WEIGHTS
+    and prioritized by ORDER_METHODS
+    """
+
+    def __init__(self, client, scheduler: RequestScheduler):
+        self.client = client
+        self.scheduler = scheduler
+
+    def __getattr__(self, name: str):
+        if name in ("client", "scheduler"):
+            raise AttributeError(name)
+        attribute = getattr(self.client, name)
+        if not callable(attribute) or name.startswith("_"):
+            return attribute
+        weight = request_weight(name)
+        priority = PRIORITY_ORDER if name in ORDER_METHODS else PRIORITY_READ
+
+        duration = REQUEST_DURATION.labels(name)
+        wait = REQUEST_WAIT.labels(name)
+
+        def call(*args, **kwargs):
+            queued = time.perf_counter()
+            self.scheduler.acquire(weight, priority)
+            start = time.perf_counter()
+            wait.observe(start - queued)
+            try:
+                return attribute(*args, **kwargs)
+            except BinanceAPIException as e:
+                REQUEST_ERRORS.labels(name, e.status_code).inc()
+                self.scheduler.handle_exception(e)
+                raise
+            finally:
+                duration.observe(time.perf_counter() - start)
+                self.scheduler.update_used_weight(getattr(self.client, "response", None))
+
+        return call
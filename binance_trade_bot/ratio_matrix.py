@@ -0,0 +1,109 @@
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from .models import Pair
+
+
+def jump_scores(  # pylint: disable=too-many-arguments
+    coin_opt_coin_ratio: np.ndarray,
+    transaction_fee: np.ndarray,
+    ratios: np.ndarray,
+    use_margin: bool,
+    scout_multiplier: float,
+    scout_margin: float,
+) -> np.ndarray:
+    """
+    Elementwise jump score from the price ratio of two coins, the fee of jumping between them and the ratio
+    stored for their pair. Broadcasts like any numpy operation.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if use_margin:
+            return (1 - transaction_fee) * coin_opt_coin_ratio / ratios - 1 - scout_margin / 100
+        return (coin_opt_coin_ratio - transaction_fee * scout_multiplier * coin_opt_coin_ratio) - ratios
+
+
+class RatioMatrix:
+    """
+    Dense view of the pair graph used for scouting.
+
+    Coins are mapped to row/column indices so that the stored pair ratios form an N x N matrix,
+    the coin/bridge prices form a vector and the trade fees form a matrix. Every jump score can
+    then be computed in a single batched operation. Missing values are stored as NaN.
+    """
+
+    def __init__(self, symbols: Iterable[str]):
+        self.symbols: List[str] = list(symbols)
+        self.index: Dict[str, int] = {symbol: i for i, symbol in enumerate(self.symbols)}
+        size = len(self.symbols)
+        self.ratios = np.full((size, size), np.nan)
+        self.prices = np.full(size, np.nan)
+        self.sell_fees = np.full(size, np.nan)
+        self.buy_fees = np.full(size, np.nan)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol: str):
+        return symbol in self.index
+
+    def load_pairs(self, pairs: Iterable[Pair]):
+        for pair in pairs:
+            self.set_ratio(pair.from_coin_id, pair.to_coin_id, pair.ratio)
+
+    def set_ratio(self, from_symbol: str, to_symbol: str, ratio: Optional[float]):
+        i = self.index.get(from_symbol)
+        j = self.index.get(to_symbol)
+        if i is None or j is None:
+            return
+        self.ratios[i, j] = np.nan if ratio is None else ratio
+
+    def set_price(self, symbol: str, price: Optional[float]):
+        i = self.index.get(symbol)
+        if i is not None:
+            self.prices[i] = np.nan if price is None else price
+
+    def get_price(self, symbol: str) -> Optional[float]:
+        i = self.index.get(symbol)
+        if i is None or np.isnan(self.prices[i]):
+            return None
+        return float(self.prices[i])
+
+    def set_fees(self, symbol: str, sell_fee: Optional[float], buy_fee: Optional[float]):
+        i = self.index.get(symbol)
+        if i is None:
+            return
+        self.sell_fees[i] = np.nan if sell_fee is None else sell_fee
+        self.buy_fees[i] = np.nan if buy_fee is None else buy_fee
+
+    def has_fees(self, symbol: str) -> bool:
+        i = self.index.get(symbol)
+        return i is not None and not np.isnan(self.sell_fees[i]) and not np.isnan(self.buy_fees[i])
+
+    def fee_matrix(self) -> np.ndarray:
+        """
+        Combined fee of selling the row coin for the bridge and buying the column coin with it
+        """
+        sell = self.sell_fees[:, np.newaxis]
+        buy = self.buy_fees[np.newaxis, :]
+        return sell + buy - sell * buy
+
+    def scores(self, use_margin: bool, scout_multiplier: float, scout_margin: float) -> np.ndarray:
+        """
+        Compute the jump score of every pair at once. Entry [i, j] is the score of jumping from
+        coin i to coin j, positive values being viable jumps. Pairs that can't be scored (no ratio,
+        no price or a jump to the same coin) are NaN.
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            coin_opt_coin_ratio = self.prices[:, np.newaxis] / self.prices[np.newaxis, :]
+        scores = jump_scores(
+            coin_opt_coin_ratio, self.fee_matrix(), self.ratios, use_margin, scout_multiplier, scout_margin
+        )
+        np.fill_diagonal(scores, np.nan)
+        return scores
+
+    def row(self, scores: np.ndarray, symbol: str) -> Optional[np.ndarray]:
+        i = self.index.get(symbol)
+        if i is None:
+            return None
+        return scores[i]
@@ -0,0 +1,129 @@
+import functools
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from flask import Response, make_response, request
+
+
+class CacheEntry:  # pylint: disable=too-few-public-methods
+    def __init__(self, etag: str, body: Optional[bytes], mimetype: str, headers: List[Tuple[str, str]]):
+        self.etag = etag
+        # None for responses that were streamed or too large to keep, which can still be answered with a 304
+        self.body = body
+        self.mimetype = mimetype
+        self.headers = headers
+        self.created = time.monotonic()
+
+
+class ResponseCache:
+    """
+    Responses of the api server keyed by path and query parameters, with an ETag each.
+
+    An entry depends on the tables its endpoint reads and is dropped as soon as an update of one of them is
+    received, so a client polling an unchanged endpoint gets a 304 after a dictionary lookup. Entries also
+    expire after `max_age` seconds, for the writes of the bot that don't come with an update.
+    """
+
+    # Headers that are computed again for every response
+    SKIPPED_HEADERS = {"Content-Length", "Content-Type", "ETag", "Cache-Control"}
+
+    def __init__(self, max_age=60, max_entries=1000, max_body_size=1 << 20):
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.max_body_size = max_body_size
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._keys_by_table: Dict[str, Set[str]] = defaultdict(set)
+        self._table_versions: Dict[str, int] = defaultdict(int)
+        # ETags of a previous run of the server must not match
+        self._etag_prefix = os.urandom(4).hex()
+        self._etag_counter = itertools.count()
+        self._mutex = threading.Lock()
+
+    def invalidate(self, table: str):
+        with self._mutex:
+            self._table_versions[table] += 1
+            for key in self._keys_by_table.pop(table, ()):
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._mutex:
+            for table in self._keys_by_table:
+                self._table_versions[table] += 1
+            self._entries.clear()
+            self._keys_by_table.clear()
+
+    def _get(self, key: str) -> Optional[CacheEntry]:
+        with self._mutex:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry.created >= self.max_age:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key: str, tables: Tuple[str, ...], versions: List[int], response: Response) -> Optional[str]:
+        body = None
+        if not response.is_streamed:
+            body = response.get_data()
+            if len(body) > self.max_body_size:
+                body = None
+        headers = [(name, value) for name, value in response.headers if name not in self.SKIPPED_HEADERS]
+
+        with self._mutex:
+            # An update arrived while the response was being built, it may already be stale
+            if [self._table_versions[table] for table in tables] != versions:
+                return None
+            etag = f"{self._etag_prefix}-{next(self._etag_counter)}"
+            self._entries[key] = CacheEntry(etag, body, response.mimetype, headers)
+            self._entries.move_to_end(key)
+            for table in tables:
+                self._keys_by_table[table].add(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag
+
+    @staticmethod
+    def _key() -> str:
+        return request.path + "?" + "&".join(f"{name}={value}" for name, value in sorted(request.args.items(True)))
+
+    def cached(self, *tables: str):
+        """
+        Cache the successful responses of a view reading the given tables
+        """
+
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                key = self._key()
+                entry = self._get(key)
+                if entry is not None:
+                    if entry.etag in request.if_none_match:
+                        response = Response(status=304)
+                    elif entry.body is not None:
+                        response = Response(entry.body, mimetype=entry.mimetype, headers=entry.headers)
+                    else:
+                        response = None
+                    if response is not None:
+                        response.set_etag(entry.etag)
+                        response.headers["Cache-Control"] = "no-cache"
+                        return response
+
+                with self._mutex:
+                    versions = [self._table_versions[table] for table in tables]
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200:
+                    etag = self._put(key, tables, versions, response)
+                    if etag is not None:
+                        response.set_etag(etag)
+                        response.headers["Cache-Control"] = "no-cache"
+                return response
+
+            return wrapper
+
+        return decorator
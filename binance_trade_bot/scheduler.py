@@ -1,9 +1,30 @@
 import datetime
 import logging
+import time
 from traceback import format_exc
 
+from prometheus_client import Counter, Gauge, Histogram
 from schedule import Job, Scheduler
 
+JOB_DURATION = Histogram(
+    "scheduler_job_duration_seconds",
+    "Time taken by a run of a scheduled job",
+    ["job"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+JOB_LAST_DURATION = Gauge(
+    "scheduler_job_last_duration_seconds", "Time taken by the last run of a scheduled job", ["job"]
+)
+JOB_PERIOD = Gauge("scheduler_job_period_seconds", "Time between the scheduled runs of a job", ["job"])
+JOB_OVERRUNS = Counter(
+    "scheduler_job_overruns_total", "Runs of a scheduled job that took longer than its period", ["job"]
+)
+JOB_FAILURES = Counter("scheduler_job_failures_total", "Runs of a scheduled job that raised an exception", ["job"])
+
+
+def job_name(job: Job) -> str:
+    return next(iter(job.tags), None) or getattr(job.job_func, "__name__", repr(job.job_func))
+
 
 class SafeScheduler(Scheduler):
     """
@@ -12,6 +33,8 @@ class SafeScheduler(Scheduler):
 
     Use this to run jobs that may or may not crash without worrying about
     whether other jobs will run or if they'll crash the entire script.
+
+    Every run is timed into the scheduler_job_* metrics, labelled by the first tag of the job.
     """
 
     def __init__(self, logger: logging.Logger, rerun_immediately=True):
@@ -21,13 +44,34 @@ class SafeScheduler(Scheduler):
         super().__init__()
 
     def _run_job(self, job: Job):
+        name = job_name(job)
+        start = time.perf_counter()
         try:
             super()._run_job(job)
         except Exception:  # pylint: disable=broad-except
-            self.logger.error(f"Error while {next(iter(job.tags))}...\n{format_exc()}")
+            JOB_FAILURES.labels(name).inc()
+            self.logger.error(f"Error while {name}...\n{format_exc()}")
             job.last_run = datetime.datetime.now()
             if not self.rerun_immediately:
                 # Reschedule the job for the next time it was meant to run, instead of
                 # letting it run
                 # next tick
                 job._schedule_next_run()  # pylint: disable=protected-access
+        finally:
+            self._record_run(job, name, time.perf_counter() - start)
+
+    @staticmethod
+    def _record_run(job: Job, name: str, duration: float):
+        JOB_DURATION.labels(name).observe(duration)
+        JOB_LAST_DURATION.labels(name).set(duration)
+        if job.period is not None:
+            period = job.period.total_seconds()
+            JOB_PERIOD.labels(name).set(period)
+            if duration > period:
+                JOB_OVERRUNS.labels(name).inc()
+
+    def run_now(self, job: Job):
+        """
+        Run a job right away, its next scheduled run then counts from now
+        """
+        self._run_job(job)
@@ -0,0 +1,97 @@
+import atexit
+import queue
+import threading
+import time
+from typing import List
+
+from .logger import Logger
+from .models import ScoutHistory
+
+
+class ScoutHistoryWriter:
+    """
+    Buffers scout history records and inserts them from a background thread, one transaction per batch.
+
+    A batch is written once it holds `batch_size` records or `flush_interval` seconds after its first
+    record arrived. The queue is bounded: when the writer can't keep up, new records are dropped
+    instead of making the scout wait on disk I/O.
+    """
+
+    def __init__(self, db, logger: Logger, batch_size=500, flush_interval=2.0, max_queued=20000):
+        self.db = db
+        self.logger = logger
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: "queue.Queue[ScoutHistory]" = queue.Queue(maxsize=max_queued)
+        self.dropped = 0
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="scout-history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def put(self, scout: ScoutHistory) -> bool:
+        try:
+            self.queue.put_nowait(scout)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                self.logger.warning(
+                    f"Scout history writer is falling behind, {self.dropped} records dropped so far", False
+                )
+            return False
+
+    def stop(self, timeout=10.0):
+        """
+        Write every queued record and stop the writer thread
+        """
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    def _next_batch(self) -> List[ScoutHistory]:
+        batch: List[ScoutHistory] = []
+        deadline = None
+        while len(batch) < self.batch_size:
+            if deadline is None:
+                timeout = self.flush_interval
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                if self._stopping.is_set() or deadline is not None:
+                    break
+                continue
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set() or not self.queue.empty():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._write(batch)
+            except Exception as e:  # pylint: disable=broad-except
+                self.logger.error(f"Failed to write {len(batch)} scout history records: {e}", False)
+
+    def _write(self, batch: List[ScoutHistory]):
+        with self.db.db_session() as session:
+            session.execute(
+                ScoutHistory.__table__.insert(),
+                [
+                    {
+                        "pair_id": scout.pair.id,
+                        "target_ratio": scout.target_ratio,
+                        "current_coin_price": scout.current_coin_price,
+                        "other_coin_price": scout.other_coin_price,
+                        "datetime": scout.datetime,
+                    }
+                    for scout in batch
+                ],
+            )
+        for scout in batch:
+            self.db.send_update(scout)
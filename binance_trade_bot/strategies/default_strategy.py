@@ -71,8 +71,10 @@ class Strategy(AutoTrader):
                 
                 # 1. Check if we already hold supported assets (Highest Value Priority)
                 assets = []
+                # A single account request for every coin
+                total_balances = self.manager.get_total_balances()
                 for coin in self.config.SUPPORTED_COIN_LIST:
-                    balance = self.manager.get_total_balance(coin) # Use Total Balance (Free + Locked)
+                    balance = total_balances.get(coin, 0.0) # Use Total Balance (Free + Locked)
                     if balance > 0:
                         price = self.manager.get_ticker_price(coin + self.config.BRIDGE.symbol)
                         if price:
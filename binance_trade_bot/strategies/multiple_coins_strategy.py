@@ -17,9 +17,12 @@ class Strategy(AutoTrader):
         if current_coin is not None:
             current_coin_symbol = current_coin.symbol
 
+        # Every jump score is computed at once, and only recomputed after a jump changed the ratios
+        scores = self._scout_scores()
+
         for coin in self.db.get_coins():
             current_coin_balance = self.manager.get_currency_balance(coin.symbol)
-            coin_price = self.manager.get_ticker_price(coin + self.config.BRIDGE)
+            coin_price = self.ratio_matrix.get_price(coin.symbol)
 
             if coin_price is None:
                 self.logger.info(f"Skipping scouting... current coin {coin + self.config.BRIDGE} not found")
@@ -40,7 +43,8 @@ class Strategy(AutoTrader):
                 end="\r",
             )
 
-            self._jump_to_best_coin(coin, coin_price)
+            if self._jump_to_best_coin(coin, coin_price, scores) is not None:
+                scores = self._scout_scores()
 
         if not have_coin:
             self.bridge_scout()
@@ -0,0 +1,121 @@
+import contextlib
+import csv
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, Iterable, List
+
+from binance.client import Client
+
+from .backtest import backtest, backtest_symbols
+from .config import Config
+from .kline_store import KlineStore, prefetch_klines
+from .logger import Logger
+
+# Sweepable parameters and the Config attribute each one overrides. `interval` is passed to backtest().
+CONFIG_PARAMETERS = {
+    "scout_multiplier": "SCOUT_MULTIPLIER",
+    "scout_margin": "SCOUT_MARGIN",
+    "use_margin": "USE_MARGIN",
+    "strategy": "STRATEGY",
+}
+
+
+def parameter_grid(grid: Dict[str, Iterable[Any]]) -> List[Dict[str, Any]]:
+    """
+    Every combination of the given parameter values, e.g. {"scout_multiplier": [3, 5], "interval": [1, 5]}
+    """
+    for name in grid:
+        if name not in CONFIG_PARAMETERS and name != "interval":
+            raise ValueError(f"Unknown sweep parameter: {name}")
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def _run_configuration(
+    parameters: Dict[str, Any], start_date: datetime, end_date: datetime, start_balances: Dict[str, float]
+) -> Dict[str, Any]:
+    config = Config()
+    for name, value in parameters.items():
+        if name in CONFIG_PARAMETERS:
+            setattr(config, CONFIG_PARAMETERS[name], value)
+
+    manager = None
+    # The trader prints and logs every scout, only the log file is kept for sweeps
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            for manager in backtest(
+                start_date,
+                end_date,
+                interval=parameters.get("interval", 1),
+                start_balances=start_balances,
+                config=config,
+                binance_client=Client(ping=False),
+                prefetch=False,
+                klines=KlineStore(read_only=True),
+                fast=True,
+            ):
+                pass
+
+    return {**parameters, **manager.result().info()}
+
+
+def sweep(
+    grid: Dict[str, Iterable[Any]],
+    start_date: datetime,
+    end_date: datetime = None,
+    start_balances: Dict[str, float] = None,
+    processes: int = None,
+    output: str = None,
+    binance_client: Client = None,
+) -> List[Dict[str, Any]]:
+    """
+    Backtest every combination of `grid` over the same period, fanned out over a process pool.
+
+    The prices of the period are downloaded once into the kline store, which every run then maps
+    read-only, so all the processes share one copy of the dataset through the page cache.
+
+    :param grid: Values to try for each parameter: scout_multiplier, scout_margin, use_margin, strategy, interval
+    :param start_date: Date to backtest from
+    :param end_date: Date to backtest up to. Default: now
+    :param start_balances: A dictionary of initial coin values. Default: {BRIDGE: 100}
+    :param processes: Number of worker processes. Default: one per core
+    :param output: Optional path of a CSV file to write the result table to
+    :param binance_client: Client to fetch the historical prices from. Default: a new binance Client
+
+    :return: One row per configuration, sorted from the best to the worst return
+    """
+    end_date = end_date or datetime.today()
+    configurations = parameter_grid(grid)
+    logger = Logger("sweep", enable_notifications=False)
+
+    config = Config()
+    klines = KlineStore()
+    prefetch_klines(klines, binance_client or Client(), backtest_symbols(config), start_date, end_date, logger)
+
+    logger.info(f"Running {len(configurations)} backtests")
+    results = []
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = {
+            executor.submit(_run_configuration, parameters, start_date, end_date, start_balances): parameters
+            for parameters in configurations
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error(f"Backtest {futures[future]} failed: {e}")
+                continue
+            logger.info(f"{futures[future]}: {result['return_pct']:.2f}%", False)
+            results.append(result)
+
+    results.sort(key=lambda result: result["return_pct"], reverse=True)
+
+    if output is not None and results:
+        with open(output, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+
+    return results
@@ -0,0 +1,127 @@
+import atexit
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Tuple
+
+from socketio import Client
+from socketio.exceptions import ConnectionError as SocketIOConnectionError
+
+from .logger import Logger
+
+
+class UpdateEmitter:
+    """
+    Sends the updates of the bot to the api server from a background thread, so that the trading thread
+    never waits on the dashboard.
+
+    Updates arriving within `flush_interval` seconds are coalesced into one message per table, holding the
+    latest row in `data` and up to `max_batch` rows in `batch`. The queue is bounded: when the api server
+    can't keep up or isn't reachable, the oldest updates are dropped. Connecting is retried with an
+    exponential backoff of `min_backoff` to `max_backoff` seconds.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        logger: Logger,
+        url="http://api:5123",
+        flush_interval=0.5,
+        max_queued=5000,
+        max_batch=100,
+        min_backoff=1.0,
+        max_backoff=60.0,
+    ):
+        self.logger = logger
+        self.url = url
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.queue: Deque[Tuple[str, Dict[str, Any]]] = deque(maxlen=max_queued)
+        self.dropped = 0
+        # Reconnection is handled by the emitter thread, with its own backoff
+        self.socketio_client = Client(reconnection=False)
+        self._backoff = min_backoff
+        self._next_connect = 0.0
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="update-emitter", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def put(self, table: str, data: Dict[str, Any]):
+        with self._condition:
+            if len(self.queue) == self.queue.maxlen:
+                # The deque drops its oldest update
+                self.dropped += 1
+            self.queue.append((table, data))
+            self._condition.notify()
+
+    def stop(self, timeout=2.0):
+        """
+        Send what is queued if the api server is connected, and stop the emitter thread
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join(timeout)
+        if self.socketio_client.connected:
+            self.socketio_client.disconnect()
+
+    def _next_batch(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._condition:
+            while not self.queue and not self._stopping:
+                self._condition.wait()
+        # Let a burst of updates come in before sending them
+        if not self._stopping:
+            time.sleep(self.flush_interval)
+        with self._condition:
+            batch = list(self.queue)
+            self.queue.clear()
+        return batch
+
+    def _coalesce(self, batch: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        rows_by_table: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        for table, data in batch:
+            rows_by_table.setdefault(table, []).append(data)
+        messages = []
+        for table, rows in rows_by_table.items():
+            if len(rows) > self.max_batch:
+                self.dropped += len(rows) - self.max_batch
+                rows = rows[-self.max_batch :]
+            messages.append({"table": table, "data": rows[-1], "batch": rows})
+        return messages
+
+    def _connect(self) -> bool:
+        if self.socketio_client.connected:
+            return True
+        if time.monotonic() < self._next_connect:
+            return False
+        try:
+            self.socketio_client.connect(self.url, namespaces=["/backend"])
+            self._backoff = self.min_backoff
+            return True
+        except SocketIOConnectionError:
+            self._next_connect = time.monotonic() + self._backoff
+            self._backoff = min(self._backoff * 2, self.max_backoff)
+            return False
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if self._stopping:
+                    return
+                continue
+            if not self._connect():
+                # Nobody is listening, the dashboard loads the history when it reconnects anyway
+                self.dropped += len(batch)
+                continue
+            for message in self._coalesce(batch):
+                try:
+                    self.socketio_client.emit("update", message, namespace="/backend")
+                except Exception as e:  # pylint: disable=broad-except
+                    self.logger.warning(f"Failed to send an update to the api server: {e}", False)
+                    break
+            if self._stopping:
+                return
@@ -0,0 +1,18 @@
+from datetime import datetime
+
+from binance_trade_bot.sweep import sweep
+
+if __name__ == "__main__":
+    results = sweep(
+        {
+            "strategy": ["default", "multiple_coins"],
+            "use_margin": ["no"],
+            "scout_multiplier": [3, 5, 7],
+            "interval": [1, 5],
+        },
+        datetime(2021, 1, 1),
+        datetime(2021, 2, 1),
+        output="data/sweep.csv",
+    )
+    for result in results:
+        print(result)
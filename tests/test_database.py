@@ -0,0 +1,63 @@
+import pytest
+
+from binance_trade_bot.config import Config
+from binance_trade_bot.database import Database
+from binance_trade_bot.logger import Logger
+from binance_trade_bot.models import CurrentCoin, Pair
+
+
+@pytest.fixture(name="database_uri")
+def fixture_database_uri(tmp_path, monkeypatch):
+    # The logger writes to logs/ in the working directory
+    (tmp_path / "logs").mkdir()
+    monkeypatch.chdir(tmp_path)
+    return f"sqlite:///{tmp_path / 'crypto_trading.db'}"
+
+
+def open_database(uri: str) -> Database:
+    db = Database(Logger("test", enable_notifications=False), Config(), uri)
+    db.create_database()
+    db.set_coins(["AAA", "BBB"])
+    return db
+
+
+def test_unit_of_work_rollback_keeps_trading_state(database_uri):
+    db = open_database(database_uri)
+    config = db.config
+    db.set_current_coin(config.BRIDGE)
+
+    with pytest.raises(RuntimeError):
+        with db.unit_of_work():
+            db.set_current_coin("BBB")
+            db.update_pair_ratios({db.get_pair("AAA", "BBB"): 1.5})
+            raise RuntimeError("scout failed after trading")
+
+    assert db.get_current_coin().symbol == "BBB"
+    assert db.get_pair("AAA", "BBB").ratio == 1.5
+
+    # What a restart would load
+    with db.db_session() as session:
+        current_coin = session.query(CurrentCoin).order_by(CurrentCoin.datetime.desc()).first()
+        assert current_coin.coin_id == "BBB"
+        pair = session.query(Pair).filter(Pair.from_coin_id == "AAA", Pair.to_coin_id == "BBB").one()
+        assert pair.ratio == 1.5
+    db.close()
+
+    restarted = open_database(database_uri)
+    assert restarted.get_current_coin().symbol == "BBB"
+    assert restarted.get_pair("AAA", "BBB").ratio == 1.5
+    restarted.close()
+
+
+def test_unit_of_work_rollback_discards_other_writes(database_uri):
+    db = open_database(database_uri)
+
+    with pytest.raises(RuntimeError):
+        with db.unit_of_work() as session:
+            session.add(CurrentCoin(db.get_coin("AAA")))
+            raise RuntimeError("job failed")
+
+    with db.db_session() as session:
+        assert session.query(CurrentCoin).count() == 0
+    assert db.get_current_coin() is None
+    db.close()